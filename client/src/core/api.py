@@ -1,9 +1,39 @@
+import json
+import base64
+import struct
+import threading
+import numpy as np
 import requests
 from ..utils.helpers import SERVER_URL, DEVICE_ID
 
+try:
+    import websocket  # websocket-client (optional): persistent scan channel
+except ImportError:
+    websocket = None
+
+
+def encode_embedding(embedding) -> str:
+    """Base64 of the raw little-endian float32 embedding (~4x smaller than a JSON list)"""
+    return base64.b64encode(np.asarray(embedding, dtype="<f4").tobytes()).decode("ascii")
+
+
+class StreamScanResponse:
+    """Result from the scan channel, shaped like the requests.Response the scan handling reads."""
+
+    def __init__(self, body: dict):
+        self.status_code = body.pop("status_code", 200)
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
 class SentinelAPI:
     def __init__(self, server_url=SERVER_URL):
         self.server_url = server_url
+        self._ws = None
+        self._ws_lock = threading.Lock()
+        self._ws_request_id = 0
 
     def start_session(self):
         """Start a new verification session."""
@@ -55,6 +85,95 @@ class SentinelAPI:
             print(f"API Error (scan_session): {e}")
             return None
 
+    def scan_session_batch(self, payload):
+        """Send every face embedding of one frame for session verification."""
+        try:
+            resp = requests.post(
+                f"{self.server_url}/api/session/scan-batch", 
+                json=payload, 
+                timeout=5
+            )
+            return resp
+        except Exception as e:
+            print(f"API Error (scan_session_batch): {e}")
+            return None
+
+    def scan_stream(self, session_id, embeddings):
+        """
+        Send one frame's face embeddings over the persistent WebSocket scan
+        channel (binary float32, no JSON floats). Falls back to the HTTP scan
+        endpoints when websocket-client is missing or the channel fails.
+        """
+        if websocket is not None:
+            try:
+                return self._scan_over_stream(session_id, embeddings)
+            except Exception as e:
+                print(f"API Error (scan_stream), using HTTP: {e}")
+                self._close_stream()
+
+        if len(embeddings) > 1:
+            return self.scan_session_batch({"session_id": session_id, "embeddings_b64": [encode_embedding(e) for e in embeddings]})
+        return self.scan_session({"session_id": session_id, "embedding_b64": encode_embedding(embeddings[0])})
+
+    def _scan_over_stream(self, session_id, embeddings):
+        sid = session_id.encode("ascii")
+        matrix = np.ascontiguousarray(np.stack(embeddings), dtype="<f4")
+        with self._ws_lock:
+            if self._ws is None:
+                ws_url = self.server_url.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+                self._ws = websocket.create_connection(f"{ws_url}/api/session/scan-stream", timeout=5)
+            self._ws_request_id = (self._ws_request_id + 1) & 0xFFFFFFFF
+            request_id = self._ws_request_id
+            frame = bytes([len(sid)]) + sid + struct.pack("<IH", request_id, len(matrix)) + matrix.tobytes()
+            self._ws.send_binary(frame)
+            while True:
+                body = json.loads(self._ws.recv())
+                if body.get("request_id") == request_id:
+                    return StreamScanResponse(body)
+                # Stale reply to a request that timed out earlier: skip it
+
+    def _close_stream(self):
+        with self._ws_lock:
+            if self._ws is not None:
+                try:
+                    self._ws.close()
+                except Exception:
+                    pass
+                self._ws = None
+
+    def stream_session_events(self, session_id):
+        """
+        Yield session state dicts pushed by the server (Server-Sent Events)
+        until the session finishes or the connection drops.
+        """
+        with requests.get(
+            f"{self.server_url}/api/session/{session_id}/events",
+            stream=True,
+            timeout=(5, 30),  # Read timeout well above the server's keep-alive interval
+        ) as resp:
+            if resp.status_code == 404:
+                # Session already gone on the server: treat it as expired
+                yield {"session_id": session_id, "state": "expired", "vendors": []}
+                return
+            if resp.status_code != 200:
+                return
+            event, data = None, []
+            for line in resp.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line == "":
+                    # Blank line ends one event
+                    if event == "state" and data:
+                        yield json.loads("\n".join(data))
+                    elif event == "gone":
+                        yield {"session_id": session_id, "state": "expired", "vendors": []}
+                        return
+                    event, data = None, []
+                elif line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+
     def send_heartbeat(self, device_id: str) -> dict:
         """Send heartbeat to Python server (which proxies to Laravel)."""
         if not device_id:
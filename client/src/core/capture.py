@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+
+import cv2
+
+from ..utils.helpers import CAPTURE_BUFFER_SIZE
+
+# One captured frame. Frames are never written to after capture, so consumers
+# can hold on to them without copying.
+FramePacket = namedtuple("FramePacket", ["seq", "timestamp", "frame"])
+
+
+class FrameReader:
+    """A consumer's view of the capture: newest frame only, counting the ones it skipped."""
+
+    def __init__(self, capture, name: str):
+        self.capture = capture
+        self.name = name
+        self.last_seq = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def latest(self) -> Optional[FramePacket]:
+        """Newest frame if it is newer than the last one read, else None (never blocks)."""
+        packet = self.capture.latest()
+        with self._lock:
+            if packet is None or packet.seq <= self.last_seq:
+                return None
+            if self.last_seq:
+                self.dropped += packet.seq - self.last_seq - 1
+            self.last_seq = packet.seq
+        return packet
+
+
+class CameraCapture:
+    """
+    Dedicated camera thread filling a small ring buffer of FramePackets.
+    The UI and the recognizer read the newest frame through FrameReaders,
+    so a slow or blocking camera never stalls the Tk main loop.
+    """
+
+    def __init__(self, buffer_size: int = CAPTURE_BUFFER_SIZE):
+        self._ring = [None] * max(1, buffer_size)
+        self._seq = 0
+        self._lock = threading.Lock()  # Guards the ring and sequence number
+        self._cap_lock = threading.Lock()  # Guards the VideoCapture (read vs. switch)
+        self._cap = None
+        self._readers = []
+        self._thread = None
+        self.running = False
+        self.read_failures = 0
+
+    def open(self, index: int) -> bool:
+        """Open (or switch to) a camera. Returns False if it cannot be opened."""
+        cap = cv2.VideoCapture(index)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        with self._cap_lock:
+            old, self._cap = self._cap, cap
+        if old is not None:
+            old.release()
+        return True
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="camera-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        with self._cap_lock:
+            if self._cap is not None:
+                self._cap.release()
+                self._cap = None
+
+    def reader(self, name: str) -> FrameReader:
+        reader = FrameReader(self, name)
+        self._readers.append(reader)
+        return reader
+
+    def latest(self) -> Optional[FramePacket]:
+        with self._lock:
+            if not self._seq:
+                return None
+            return self._ring[self._seq % len(self._ring)]
+
+    def _run(self):
+        while self.running:
+            with self._cap_lock:
+                ok, frame = self._cap.read() if self._cap is not None else (False, None)
+            if not ok:
+                self.read_failures += 1
+                time.sleep(0.05)  # Camera unplugged or switching: don't spin
+                continue
+            with self._lock:
+                self._seq += 1
+                self._ring[self._seq % len(self._ring)] = FramePacket(self._seq, time.monotonic(), frame)
+
+    def metrics(self) -> dict:
+        """Frames captured, camera read failures and frames each consumer skipped."""
+        return {
+            "captured": self._seq,
+            "read_failures": self.read_failures,
+            "dropped": {reader.name: reader.dropped for reader in self._readers},
+        }
@@ -1,8 +1,54 @@
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
 import numpy as np
 from typing import Optional, Tuple, List
 
-from ..utils.helpers import MODEL_NAME, MODEL_DIR, DET_SIZE
+from ..utils.helpers import MODEL_NAME, MODEL_DIR, DET_SIZE, DET_SIZE_MIN, FACE_ALLOWED_MODULES
+
+REFINE_MARGIN = 0.5  # Crop around a low-res candidate, as a fraction of its size
+
+
+def detect_adaptive(det_model, frame: np.ndarray, det_size: int = DET_SIZE, det_size_min: int = DET_SIZE_MIN):
+    """
+    Cheap low-resolution detection, then a re-detection in a crop around each
+    candidate so keypoints (used for alignment) keep full precision. Frames
+    with no face at low resolution get one det_size pass for small or distant
+    faces. Returns (bboxes, kpss) in frame coordinates, like det_model.detect.
+    """
+    full = (det_size, det_size)
+    if not det_size_min or det_size_min >= det_size:
+        return det_model.detect(frame, input_size=full, max_num=0, metric='default')
+
+    bboxes, kpss = det_model.detect(frame, input_size=(det_size_min, det_size_min), max_num=0, metric='default')
+    if bboxes.shape[0] == 0:
+        return det_model.detect(frame, input_size=full, max_num=0, metric='default')
+
+    height, width = frame.shape[:2]
+    refined_boxes, refined_kps = [], []
+    for i, box in enumerate(bboxes):
+        x1, y1, x2, y2 = box[:4]
+        mx, my = (x2 - x1) * REFINE_MARGIN, (y2 - y1) * REFINE_MARGIN
+        cx1, cy1 = max(0, int(x1 - mx)), max(0, int(y1 - my))
+        cx2, cy2 = min(width, int(x2 + mx)), min(height, int(y2 + my))
+        crop = frame[cy1:cy2, cx1:cx2]
+        # Detector input just large enough for the crop's native resolution
+        size = min(det_size, max(64, -(-max(crop.shape[:2]) // 32) * 32))
+        crop_boxes, crop_kps = det_model.detect(crop, input_size=(size, size), max_num=0, metric='default')
+        if crop_boxes.shape[0] == 0:
+            refined_boxes.append(box)
+            refined_kps.append(kpss[i] if kpss is not None else None)
+            continue
+        best = int(np.argmax(crop_boxes[:, 4]))
+        refined = crop_boxes[best].copy()
+        refined[[0, 2]] += cx1
+        refined[[1, 3]] += cy1
+        refined_boxes.append(refined)
+        refined_kps.append(crop_kps[best] + (cx1, cy1) if crop_kps is not None else None)
+
+    if any(k is None for k in refined_kps):
+        return np.stack(refined_boxes), None
+    return np.stack(refined_boxes), np.stack(refined_kps)
+
 
 class FaceDetector:
     def __init__(self, name=MODEL_NAME, root=MODEL_DIR):
@@ -14,7 +60,8 @@ class FaceDetector:
     def load(self, det_size=DET_SIZE):
         """Load and prepare the InsightFace model."""
         try:
-            self.app = FaceAnalysis(name=self.name, root=self.root)
+            # Only detection and ArcFace are used; skipping landmarks/genderage saves load time and RAM
+            self.app = FaceAnalysis(name=self.name, root=self.root, allowed_modules=FACE_ALLOWED_MODULES or None)
             self.app.prepare(ctx_id=-1, det_size=(det_size, det_size))
             self.ready = True
             return True
@@ -22,71 +69,66 @@ class FaceDetector:
             print(f"Error loading model {self.name}: {e}")
             return False
 
-    def detect_faces(self, frame: np.ndarray) -> List[dict]:
+    def detect(self, frame: np.ndarray) -> List[dict]:
         """
-        Detect all faces in the frame and return their info.
-        Returns list of dicts with 'bbox', 'det_score', 'embedding'.
+        Detection step only: find every face in the frame.
+        Returns list of dicts with 'bbox', 'det_score' and the raw 'face'
+        (keypoints) needed by embed().
         """
         if not self.ready or self.app is None:
             return []
-            
-        faces = self.app.get(frame)
-        if not faces:
-            return []
-        
+
+        bboxes, kpss = detect_adaptive(self.app.det_model, frame)
         result = []
-        for face in faces:
-            bbox = face.bbox.astype(int).tolist()  # [x1, y1, x2, y2]
-            det_score = float(face.det_score)
-            emb = face.normed_embedding
-            if emb is not None and emb.size > 0:
-                emb = emb.astype(np.float32)
-            else:
-                emb = None
+        for i in range(bboxes.shape[0]):
+            face = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None,
+                        det_score=bboxes[i, 4])
             result.append({
-                'bbox': bbox,
-                'det_score': det_score,
-                'embedding': emb
+                'bbox': face.bbox.astype(int).tolist(),  # [x1, y1, x2, y2]
+                'det_score': float(face.det_score),
+                'face': face
             })
         return result
 
+    def embed(self, frame: np.ndarray, faces: List[dict]) -> List[dict]:
+        """
+        Recognition step: run only the ArcFace model on detected faces (it
+        aligns on the detector's keypoints) and fill in each face's
+        'embedding' (None if it could not be computed).
+        """
+        recognition = self.app.models['recognition']
+        for info in faces:
+            face = info['face']
+            recognition.get(frame, face)
+            emb = face.normed_embedding
+            info['embedding'] = emb.astype(np.float32) if emb is not None and emb.size > 0 else None
+        return faces
+
+    def detect_faces(self, frame: np.ndarray) -> List[dict]:
+        """
+        Detect all faces in the frame and return their info.
+        Returns list of dicts with 'bbox', 'det_score', 'embedding'.
+        """
+        faces = self.detect(frame)
+        if not faces:
+            return []
+        return self.embed(frame, faces)
+
     def extract_embedding(self, frame: np.ndarray) -> Optional[np.ndarray]:
         """Extract the embedding for the largest face in the frame."""
-        if not self.ready or self.app is None:
-            return None
-            
-        faces = self.app.get(frame)
-        if not faces:
-            return None
-            
-        # Select the largest face by bounding box area
-        face = max(faces, key=lambda f: (f.bbox[2]-f.bbox[0]) * (f.bbox[3]-f.bbox[1]))
-        emb = face.normed_embedding
-        
-        if emb is None or emb.size == 0:
-            return None
-            
-        return emb.astype(np.float32)
+        return self.extract_embedding_with_bbox(frame)[0]
     
     def extract_embedding_with_bbox(self, frame: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[List[int]]]:
         """
         Extract embedding for the largest face and return its bounding box.
         Returns (embedding, bbox) tuple where bbox is [x1, y1, x2, y2].
         """
-        if not self.ready or self.app is None:
-            return None, None
-            
-        faces = self.app.get(frame)
+        faces = self.detect(frame)
         if not faces:
             return None, None
             
-        # Select the largest face by bounding box area
-        face = max(faces, key=lambda f: (f.bbox[2]-f.bbox[0]) * (f.bbox[3]-f.bbox[1]))
-        bbox = face.bbox.astype(int).tolist()
-        emb = face.normed_embedding
-        
-        if emb is None or emb.size == 0:
-            return None, bbox
-            
-        return emb.astype(np.float32), bbox
+        # Select the largest face by bounding box area; only that one is recognized
+        face = max(faces, key=lambda f: (f['bbox'][2]-f['bbox'][0]) * (f['bbox'][3]-f['bbox'][1]))
+        self.embed(frame, [face])
+        return face['embedding'], face['bbox']
 
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from .capture import FramePacket
+
+STAGES = ("detect", "embed", "submit")
+LATENCY_WINDOW = 50  # Samples kept per stage
+
+
+class LatestSlot:
+    """Depth-1 queue: a new item replaces one the worker has not taken yet."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.superseded = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.superseded += 1
+            self._item = item
+            self._cond.notify()
+
+    def take(self, timeout: float):
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+
+class RecognitionPipeline:
+    """
+    Single inference worker running detect -> embed -> submit on the newest
+    offered frame. Frames offered while it is busy replace each other, so the
+    kiosk recognizes as often as the hardware allows and never on stale frames.
+
+    detect(frame) -> faces (falsy stops the frame)
+    embed(frame, faces) -> embeddings (falsy stops the frame)
+    submit(packet, faces, embeddings)
+    """
+
+    def __init__(self, detect: Callable, embed: Callable, submit: Callable):
+        self.stages = {"detect": detect, "embed": embed, "submit": submit}
+        self._slot = LatestSlot()
+        self._latency = {name: deque(maxlen=LATENCY_WINDOW) for name in STAGES}
+        self._frame_age = deque(maxlen=LATENCY_WINDOW)  # Capture -> done, in ms
+        self._thread = None
+        self.running = False
+        self.processed = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="recognition", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def offer(self, packet: FramePacket):
+        """Hand the worker a frame; replaces any frame still waiting."""
+        self._slot.put(packet)
+
+    def _timed(self, stage: str, *args):
+        start = time.perf_counter()
+        try:
+            return self.stages[stage](*args)
+        finally:
+            self._latency[stage].append((time.perf_counter() - start) * 1000)
+
+    def _run(self):
+        while self.running:
+            packet = self._slot.take(timeout=0.5)
+            if packet is None:
+                continue
+            try:
+                faces = self._timed("detect", packet.frame)
+                if faces:
+                    embeddings = self._timed("embed", packet.frame, faces)
+                    if embeddings:
+                        self._timed("submit", packet, faces, embeddings)
+                self.processed += 1
+                self._frame_age.append((time.monotonic() - packet.timestamp) * 1000)
+            except Exception as e:
+                self.errors += 1
+                print(f"Recognition error: {e}")
+
+    @staticmethod
+    def _summary(samples) -> Optional[dict]:
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return {
+            "last_ms": round(samples[-1], 1),
+            "avg_ms": round(sum(ordered) / len(ordered), 1),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+        }
+
+    def metrics(self) -> dict:
+        """Per-stage latency, frame-to-decision latency and frames skipped."""
+        return {
+            "processed": self.processed,
+            "superseded": self._slot.superseded,
+            "errors": self.errors,
+            "stages": {name: self._summary(list(self._latency[name])) for name in STAGES},
+            "frame_to_decision": self._summary(list(self._frame_age)),
+        }
@@ -0,0 +1,146 @@
+import itertools
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from ..utils.helpers import (
+    TRACK_IOU_THRESHOLD, TRACK_MAX_AGE, TRACK_MAX_SHAPE_CHANGE, TRACK_REEMBED_GAIN, TRACK_EMBEDDING_TTL
+)
+
+
+def _iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = _area(a) + _area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _area(bbox) -> float:
+    return max(0, bbox[2] - bbox[0]) * max(0, bbox[3] - bbox[1])
+
+
+def _shape_changed(a, b) -> bool:
+    """Sharp jump in box size or aspect ratio: likely someone else in the same spot."""
+    area_a, area_b = _area(a), _area(b)
+    if not area_a or not area_b:
+        return True
+    aspect_a = (a[2] - a[0]) / (a[3] - a[1])
+    aspect_b = (b[2] - b[0]) / (b[3] - b[1])
+    return (
+        max(area_a, area_b) / min(area_a, area_b) > TRACK_MAX_SHAPE_CHANGE
+        or max(aspect_a, aspect_b) / min(aspect_a, aspect_b) > TRACK_MAX_SHAPE_CHANGE
+    )
+
+
+def face_quality(face: dict) -> float:
+    """Detector confidence weighted by face size: bigger, sharper faces embed better."""
+    return face['det_score'] * _area(face['bbox'])
+
+
+class Track:
+    def __init__(self, track_id: int, face: dict, now: float):
+        self.id = track_id
+        self.bbox = face['bbox']
+        self.last_seen = now
+        self.embedding: Optional[np.ndarray] = None
+        self.embedding_quality = 0.0
+        self.embedded_at = 0.0
+
+    def needs_embedding(self, face: dict, now: float) -> bool:
+        """Recognize again for a new track, a clearly better view, or a stale cached embedding."""
+        return (
+            self.embedding is None
+            or face_quality(face) > self.embedding_quality * TRACK_REEMBED_GAIN
+            or now - self.embedded_at > TRACK_EMBEDDING_TTL
+        )
+
+
+class FaceTracker:
+    """
+    Lightweight IoU tracker over detections. Each face is assigned a Track
+    that caches its embedding, so a person standing in front of the camera
+    is recognized once instead of on every frame. A face only continues a
+    track if it overlaps the last box without a sharp size/aspect jump and
+    the track was seen within TRACK_MAX_AGE; anyone else stepping into the
+    same spot starts a new track and is recognized afresh.
+    """
+
+    def __init__(self):
+        self._tracks: List[Track] = []
+        self._ids = itertools.count(1)
+        self.embeddings_computed = 0
+        self.embeddings_reused = 0
+
+    def update(self, faces: List[dict]) -> List[dict]:
+        """Match detections to tracks (sets face['track']); unmatched faces start new tracks."""
+        now = time.monotonic()
+        self._tracks = [t for t in self._tracks if now - t.last_seen <= TRACK_MAX_AGE]
+
+        # Greedy matching, best overlap first
+        pairs = sorted(
+            ((_iou(t.bbox, f['bbox']), ti, fi) for ti, t in enumerate(self._tracks) for fi, f in enumerate(faces)),
+            reverse=True,
+        )
+        used_tracks, used_faces = set(), set()
+        for iou, ti, fi in pairs:
+            if ti in used_tracks or fi in used_faces:
+                continue
+            track, face = self._tracks[ti], faces[fi]
+            if iou < TRACK_IOU_THRESHOLD or _shape_changed(track.bbox, face['bbox']):
+                continue
+            used_tracks.add(ti)
+            used_faces.add(fi)
+            face['track'] = track
+
+        for fi, face in enumerate(faces):
+            if fi not in used_faces:
+                face['track'] = Track(next(self._ids), face, now)
+                self._tracks.append(face['track'])
+
+        for face in faces:
+            face['track'].bbox = face['bbox']
+            face['track'].last_seen = now
+        return faces
+
+    def pending(self, faces: List[dict]) -> List[dict]:
+        """Faces whose track has no usable cached embedding."""
+        now = time.monotonic()
+        return [f for f in faces if f['track'].needs_embedding(f, now)]
+
+    def store(self, faces: List[dict]):
+        """Cache freshly computed embeddings on their tracks."""
+        now = time.monotonic()
+        for face in faces:
+            if face.get('embedding') is None:
+                continue
+            track = face['track']
+            track.embedding = face['embedding']
+            track.embedding_quality = face_quality(face)
+            track.embedded_at = now
+            self.embeddings_computed += 1
+
+    def embeddings(self, faces: List[dict], fresh: List[dict]) -> List[np.ndarray]:
+        """Embedding for every tracked face, cached or fresh, in detection order."""
+        fresh_ids = {id(f) for f in fresh}
+        result = []
+        for face in faces:
+            embedding = face['track'].embedding
+            if embedding is None:
+                continue
+            if id(face) not in fresh_ids:
+                self.embeddings_reused += 1
+            result.append(embedding)
+        return result
+
+    def reset(self):
+        """Forget every track (e.g. when the camera changes)."""
+        self._tracks = []
+
+    def metrics(self) -> dict:
+        return {
+            "tracks": len(self._tracks),
+            "embeddings_computed": self.embeddings_computed,
+            "embeddings_reused": self.embeddings_reused,
+        }
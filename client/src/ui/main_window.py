@@ -15,6 +15,9 @@ from ..utils.helpers import (
 from .widgets import BentoCard
 from ..core.api import SentinelAPI
 from ..core.detector import FaceDetector
+from ..core.capture import CameraCapture
+from ..core.pipeline import RecognitionPipeline
+from ..core.tracker import FaceTracker
 
 
 class FaceClientApp:
@@ -56,9 +59,9 @@ class FaceClientApp:
         # Components
         self.api = SentinelAPI()
         self.detector = FaceDetector()
+        self.tracker = FaceTracker()
         
         # State
-        self.last_frame = None
         self.running = True
         self.verify_running = True
         self.session_id = None
@@ -76,11 +79,19 @@ class FaceClientApp:
         # Build UI
         self._build_ui()
         
-        # Camera
-        self.cap = cv2.VideoCapture(CAMERA_INDEX)
-        if not self.cap.isOpened():
+        # Camera: frames are captured on their own thread; the display and the
+        # recognizer each read the newest one
+        self.capture = CameraCapture()
+        if not self.capture.open(CAMERA_INDEX):
             messagebox.showerror("Camera", "Cannot open camera")
             raise SystemExit("camera not available")
+        self.capture.start()
+        self.display_frames = self.capture.reader("display")
+        self.recognizer_frames = self.capture.reader("recognizer")
+
+        # One recognition worker; the newest frame wins while it is busy
+        self.pipeline = RecognitionPipeline(self._detect_stage, self._embed_stage, self._submit_stage)
+        self.pipeline.start()
 
         # Load detector in background
         self.model_start_time = time.time()
@@ -108,7 +119,7 @@ class FaceClientApp:
         while self.running:
             result = self.api.send_heartbeat(DEVICE_ID)
             if result.get("success"):
-                print(f"Heartbeat OK: {DEVICE_ID}")
+                print(f"Heartbeat OK: {DEVICE_ID} | capture {self.capture.metrics()} | recognition {self.pipeline.metrics()} | tracker {self.tracker.metrics()}")
             else:
                 print(f"Heartbeat failed: {result.get('error')}")
             time.sleep(HEARTBEAT_INTERVAL)
@@ -155,6 +166,9 @@ class FaceClientApp:
             fg=COLORS["text_secondary"]
         )
         self.video_label.pack(expand=True, fill=tk.BOTH, padx=8, pady=8)
+        self._render_target = (0, 0)  # Label size, updated on <Configure>
+        self._render_geometry = None
+        self.video_label.bind("<Configure>", self._on_video_resize)
         
         # Camera selector
         camera_frame = tk.Frame(left_col, bg=COLORS["bg_window"])
@@ -291,10 +305,9 @@ class FaceClientApp:
                 new_index = idx
                 break
         
-        if new_index is not None and self.cap:
-            self.cap.release()
-            self.cap = cv2.VideoCapture(new_index)
-            if self.cap.isOpened():
+        if new_index is not None:
+            if self.capture.open(new_index):
+                self.tracker.reset()
                 self._update_status(f"Switched to Camera {new_index}", "info")
             else:
                 self._update_status(f"Failed to open Camera {new_index}", "error")
@@ -340,6 +353,8 @@ class FaceClientApp:
             self.root.after(0, self._update_vendors_list)
             self._update_status("Ready\nScan Vendor Face", "info")
             self.hint_var.set("💡 Look at the camera to scan your face")
+            # Session changes are pushed by the server from here on
+            threading.Thread(target=self._listen_session_events, args=(self.session_id,), daemon=True).start()
         else:
             error_msg = result.get("error", "Unknown error")
             if len(error_msg) > 60:
@@ -347,6 +362,59 @@ class FaceClientApp:
             self._update_status(f"Connection Error\n{error_msg}", "error")
             self.session_info_var.set("No active session")
 
+    def _listen_session_events(self, session_id):
+        """Follow server-pushed state changes of one session (background thread)."""
+        while self.running and self.session_id == session_id:
+            try:
+                for data in self.api.stream_session_events(session_id):
+                    if not self.running or self.session_id != session_id:
+                        return
+                    self.root.after(0, lambda d=data: self._on_session_event(d))
+                    if data.get("state") in ("completed", "expired", "cancelled"):
+                        return
+            except Exception as e:
+                print(f"Session events disconnected: {e}")
+            time.sleep(1)  # Reconnect
+
+    def _on_session_event(self, data):
+        """Apply a pushed session state change (runs on the Tk thread)."""
+        if not self.session_id or data.get("session_id") != self.session_id:
+            return
+        state, vendors = data.get("state"), data.get("vendors", [])
+
+        if vendors and vendors != self.detected_vendors:
+            self.detected_vendors = vendors
+            self._update_vendors_list()
+
+        if state in ("expired", "cancelled"):
+            self._on_session_lost()
+        elif state == "completed" and not self.verify_running:
+            # Door cycle finished: start the next session right away
+            self._clear_and_restart(self.session_id)
+
+    def _on_session_lost(self):
+        """The server no longer has our session: reset and start a new one on the next scan."""
+        self.session_id = self.session_expires_at = None
+        self.detected_vendors = []
+        self.root.after(0, self._update_session_info)
+        self.root.after(0, self._update_vendors_list)
+        self.root.after(0, lambda: self._update_step(1))
+        self._update_status("Session Expired\nRestarting...", "warning")
+
+    def _clear_and_restart(self, session_id):
+        """Leave the result screen of session_id and start a new session."""
+        if self.session_id != session_id:
+            return  # Already restarted (by the timer or a pushed event)
+        self.detected_vendors = []
+        self.session_id = None
+        self.session_expires_at = None
+        self.current_face_bbox = None
+        self.face_recognized = False
+        self.face_status_text = ""
+        self.root.after(0, self._update_vendors_list)
+        self.verify_running = True
+        self._start_session()
+
     def _update_session_info(self):
         if self.session_id and self.session_expires_at:
             remaining = int(self.session_expires_at - time.time())
@@ -386,19 +454,51 @@ class FaceClientApp:
             self._update_status("Still Loading...\n(Please Wait)", "info")
         self.root.after(2000, self._monitor_model_load)
 
+    def _on_video_resize(self, event):
+        """Display geometry changes only on resize; recompute it lazily on the next frame."""
+        self._render_target = (event.width, event.height)
+        self._render_geometry = None
+
+    def _prepare_render(self, frame_w: int, frame_h: int):
+        """Precompute the letterboxed layout and allocate the display buffer and PhotoImage."""
+        target_w, target_h = self._render_target
+        if target_w <= 10 or target_h <= 10:
+            target_w, target_h = 480, 480
+
+        scale = min(target_w / frame_w, target_h / frame_h)
+        new_w, new_h = max(1, int(frame_w * scale)), max(1, int(frame_h * scale))
+        off_x, off_y = (target_w - new_w) // 2, (target_h - new_h) // 2
+
+        # RGB canvas with the card background; frames are resized straight into its centre
+        self._render_canvas = np.empty((target_h, target_w, 3), dtype=np.uint8)
+        self._render_canvas[:] = (0x1a, 0x1a, 0x2e)
+        self._render_view = self._render_canvas[off_y:off_y + new_h, off_x:off_x + new_w]
+        self._render_photo = ImageTk.PhotoImage("RGB", (target_w, target_h))
+        self.video_label.configure(image=self._render_photo)
+        self._render_geometry = (frame_w, frame_h, self._render_target, scale)
+
     def _schedule_frame_update(self):
         if not self.running: return
-        ret, frame = self.cap.read()
-        if ret:
-            self.last_frame = frame
-            mirrored = cv2.flip(frame, 1)
+        packet = self.display_frames.latest()
+        if packet is not None:
+            frame_h, frame_w = packet.frame.shape[:2]
+            geometry = self._render_geometry
+            if geometry is None or geometry[:3] != (frame_w, frame_h, self._render_target):
+                self._prepare_render(frame_w, frame_h)
+            scale = self._render_geometry[3]
+            view = self._render_view
+            view_w = view.shape[1]
+
+            # Scale, mirror and convert in place inside the preallocated buffer
+            cv2.resize(packet.frame, (view_w, view.shape[0]), dst=view, interpolation=cv2.INTER_LINEAR)
+            cv2.flip(view, 1, dst=view)
             
             # Draw bounding box if face detected
             if self.current_face_bbox:
                 x1, y1, x2, y2 = self.current_face_bbox
-                # Mirror the x coordinates for display
-                h, w = mirrored.shape[:2]
-                x1_m, x2_m = w - x2, w - x1
+                # Scale to the display and mirror the x coordinates
+                x1_m, x2_m = int(view_w - x2 * scale), int(view_w - x1 * scale)
+                y1, y2 = int(y1 * scale), int(y2 * scale)
                 
                 # Color based on recognition status
                 if self.face_recognized:
@@ -409,79 +509,70 @@ class FaceClientApp:
                     label = self.face_status_text or "Scanning..."
                 
                 # Draw rectangle
-                cv2.rectangle(mirrored, (x1_m, y1), (x2_m, y2), color, 2)
+                cv2.rectangle(view, (x1_m, y1), (x2_m, y2), color, 2)
                 
                 # Draw label background
                 label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
-                cv2.rectangle(mirrored, (x1_m, y1 - 25), (x1_m + label_size[0] + 10, y1), color, -1)
-                cv2.putText(mirrored, label, (x1_m + 5, y1 - 7), 
+                cv2.rectangle(view, (x1_m, y1 - 25), (x1_m + label_size[0] + 10, y1), color, -1)
+                cv2.putText(view, label, (x1_m + 5, y1 - 7), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
             
-            rgb = cv2.cvtColor(mirrored, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(rgb)
-            
-            target_w = self.video_label.winfo_width() if self.video_label.winfo_width() > 10 else 480
-            target_h = self.video_label.winfo_height() if self.video_label.winfo_height() > 10 else 480
-            
-            img_ratio = img.width / img.height
-            target_ratio = target_w / target_h
-            
-            if img_ratio > target_ratio:
-                new_w, new_h = target_w, int(target_w / img_ratio)
-            else:
-                new_h, new_w = target_h, int(target_h * img_ratio)
-                
-            img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-            canvas = Image.new("RGB", (target_w, target_h), "#1a1a2e")
-            canvas.paste(img, ((target_w - new_w) // 2, (target_h - new_h) // 2))
-            
-            imgtk = ImageTk.PhotoImage(image=canvas)
-            self.video_label.imgtk = imgtk
-            self.video_label.configure(image=imgtk)
+            cv2.cvtColor(view, cv2.COLOR_BGR2RGB, dst=view)
+            # Reuse the one PhotoImage: paste copies the pixels into Tk
+            self._render_photo.paste(Image.fromarray(self._render_canvas))
             
         self.root.after(30, self._schedule_frame_update)
 
     def _schedule_verify(self):
         if not self.running: return
-        if self.verify_running:
-            threading.Thread(target=self.verify_once, daemon=True).start()
+        if self.verify_running and self.detector.ready:
+            packet = self.recognizer_frames.latest()
+            if packet is not None:
+                self.pipeline.offer(packet)
         
         # Determine delay in milliseconds
         delay_ms = CAPTURE_INTERVAL_MS if CAPTURE_INTERVAL_MS > 0 else CAPTURE_INTERVAL * 1000
         self.root.after(delay_ms, self._schedule_verify)
 
-    def verify_once(self):
-        frame = self.last_frame
-        if frame is None or not self.detector.ready: return
-        if not self.session_id: return self._start_session()
-        
-        # Use new method to get bbox along with embedding
-        embedding, bbox = self.detector.extract_embedding_with_bbox(frame)
-        
-        if bbox:
-            self.current_face_bbox = bbox
+    # Recognition pipeline stages (run on the recognition worker thread)
+
+    def _detect_stage(self, frame):
+        """Detect every face; the largest one drives the bounding box overlay."""
+        if not self.verify_running: return None
+        if not self.session_id:
+            self._start_session()
+            return None
+        
+        faces = self.tracker.update(self.detector.detect(frame))
+        
+        if faces:
+            largest = max(faces, key=lambda f: (f['bbox'][2] - f['bbox'][0]) * (f['bbox'][3] - f['bbox'][1]))
+            self.current_face_bbox = largest['bbox']
         else:
             self.current_face_bbox = None
             self.face_recognized = False
             self.face_status_text = ""
-            return
-        
-        if embedding is None:
+        return faces
+
+    def _embed_stage(self, frame, faces):
+        # Recognize only faces whose track has no usable cached embedding
+        fresh = self.tracker.pending(faces)
+        if fresh:
+            self.tracker.store(self.detector.embed(frame, fresh))
+        embeddings = self.tracker.embeddings(faces, fresh)
+        if not embeddings:
             self.face_status_text = "Processing..."
             self.face_recognized = False
-            return
-            
-        payload = {"session_id": self.session_id, "embedding": embedding.tolist()}
-        resp = self.api.scan_session(payload)
+        return embeddings
+
+    def _submit_stage(self, packet, faces, embeddings):
+        if not self.verify_running or not self.session_id: return
+        # One round trip for every face in the frame, over the persistent scan channel
+        resp = self.api.scan_stream(self.session_id, embeddings)
         
         if resp is None: return
         if resp.status_code == 404:
-            self.session_id = self.session_expires_at = None
-            self.detected_vendors = []
-            self.root.after(0, self._update_session_info)
-            self.root.after(0, self._update_vendors_list)
-            self.root.after(0, lambda: self._update_step(1))
-            self._update_status("Session Expired\nRestarting...", "warning")
+            self._on_session_lost()
             return
         
         if resp.status_code != 200: 
@@ -532,20 +623,10 @@ class FaceClientApp:
             self.hint_var.set("🚪 Door unlocking... Please enter")
             self.session_info_var.set("✓ Session approved!")
             
-            # Clear session after a delay to show the result
-            def _clear_and_restart():
-                self.detected_vendors = []
-                self.session_id = None
-                self.session_expires_at = None
-                self.current_face_bbox = None
-                self.face_recognized = False
-                self.face_status_text = ""
-                self.root.after(0, self._update_vendors_list)
-                self.verify_running = True
-                self._start_session()
-            
-            # Wait 8 seconds before starting new session
-            self.root.after(8000, _clear_and_restart)
+            # Show the result until the server reports the door cycle completed,
+            # but no longer than 8 seconds
+            approved_id = self.session_id
+            self.root.after(8000, lambda: self._clear_and_restart(approved_id))
             
         elif state == "waiting_pic":
             # Check if this is an error (wrong PIC scanned)
@@ -602,5 +683,7 @@ class FaceClientApp:
 
     def on_close(self):
         self.running = False
-        if self.cap: self.cap.release()
+        self.pipeline.stop()
+        self.api._close_stream()
+        self.capture.stop()
         self.root.destroy()
@@ -13,9 +13,19 @@ DEVICE_ID = os.getenv("DEVICE_ID", "")  # Unique ID for this device, also used a
 CAPTURE_INTERVAL = int(os.getenv("CAPTURE_INTERVAL", "5"))  # Seconds (legacy)
 CAPTURE_INTERVAL_MS = int(os.getenv("CAPTURE_INTERVAL_MS", "0"))  # Milliseconds (takes priority if > 0)
 CAMERA_INDEX = int(os.getenv("CAMERA_INDEX", "0"))
+CAPTURE_BUFFER_SIZE = int(os.getenv("CAPTURE_BUFFER_SIZE", "4"))  # Recent frames kept by the capture thread
 HEARTBEAT_INTERVAL = int(os.getenv("HEARTBEAT_INTERVAL", "60"))  # Seconds between heartbeats
 MODEL_NAME = os.getenv("MODEL_NAME", "buffalo_l")
 DET_SIZE = int(os.getenv("DET_SIZE", "320"))
+DET_SIZE_MIN = int(os.getenv("DET_SIZE_MIN", "160"))  # Cheap first detection pass, refined around faces (0 disables)
+# InsightFace models to load (landmark and genderage models are unused)
+FACE_ALLOWED_MODULES = [m.strip() for m in os.getenv("FACE_ALLOWED_MODULES", "detection,recognition").split(",") if m.strip()]
+# Face tracking: recognition reruns only for new tracks, clearly better views or stale embeddings
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+TRACK_MAX_AGE = float(os.getenv("TRACK_MAX_AGE", "0.5"))  # Seconds a lost face keeps its track
+TRACK_MAX_SHAPE_CHANGE = float(os.getenv("TRACK_MAX_SHAPE_CHANGE", "1.4"))  # Box size/aspect jump that breaks a track
+TRACK_REEMBED_GAIN = float(os.getenv("TRACK_REEMBED_GAIN", "1.3"))  # Quality ratio that triggers re-recognition
+TRACK_EMBEDDING_TTL = float(os.getenv("TRACK_EMBEDDING_TTL", "5.0"))  # Seconds a cached embedding is reused
 
 # Paths
 BASE_DIR = Path(__file__).parent.parent.parent
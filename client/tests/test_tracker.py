@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from src.core import tracker as tracker_module
+from src.core.tracker import FaceTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(tracker_module.time, "monotonic", clock)
+    return clock
+
+
+def face(bbox, score=0.9):
+    return {"bbox": np.array(bbox, dtype=np.float32), "det_score": score}
+
+
+def see(tracker, bbox, embedding=None):
+    """Run one frame with a single face; embed it if the tracker asks to."""
+    faces = tracker.update([face(bbox)])
+    pending = tracker.pending(faces)
+    for f in pending:
+        f["embedding"] = embedding
+    tracker.store(pending)
+    return faces[0], pending
+
+
+def test_same_person_reuses_embedding(clock):
+    tracker = FaceTracker()
+    person_a = np.ones(512, dtype=np.float32)
+    first, pending = see(tracker, [100, 100, 200, 220], person_a)
+    assert pending
+
+    clock.now += 0.1
+    second, pending = see(tracker, [104, 98, 205, 219])
+    assert not pending
+    assert second["track"] is first["track"]
+    assert tracker.embeddings([second], [])[0] is person_a
+
+
+def test_swap_in_place_after_gap_is_recognized_again(clock):
+    tracker = FaceTracker()
+    person_a, person_b = np.ones(512, dtype=np.float32), np.zeros(512, dtype=np.float32)
+    first, _ = see(tracker, [100, 100, 200, 220], person_a)
+
+    # A walks off, B steps into the same spot with a same-sized face
+    clock.now += 0.3
+    tracker.update([])
+    clock.now += 0.5
+    second, pending = see(tracker, [102, 101, 201, 221], person_b)
+
+    assert pending
+    assert second["track"] is not first["track"]
+    assert tracker.embeddings([second], pending)[0] is person_b
+
+
+def test_swap_in_place_with_different_face_shape_is_recognized_again(clock):
+    tracker = FaceTracker()
+    first, _ = see(tracker, [100, 100, 200, 220], np.ones(512, dtype=np.float32))
+
+    # Next frame: an overlapping but clearly smaller, narrower face
+    clock.now += 0.1
+    second, pending = see(tracker, [115, 110, 175, 210])
+
+    assert pending
+    assert second["track"] is not first["track"]
+
+
+def test_face_without_overlap_starts_new_track(clock):
+    tracker = FaceTracker()
+    first, _ = see(tracker, [100, 100, 200, 220], np.ones(512, dtype=np.float32))
+
+    # Centres within half a face width, but too little overlap to be the same face
+    clock.now += 0.1
+    second, pending = see(tracker, [135, 135, 235, 255])
+
+    assert pending
+    assert second["track"] is not first["track"]
@@ -0,0 +1,254 @@
+"""
+Access Index - In-memory authorization index for task validation
+Maps (vendor_id, pic_id) to the tasks that can currently grant access, with
+their time windows and authorized gates, so PIC approval is a dictionary
+lookup instead of a join plus lazy gate loads per vendor. Task changes are
+applied incrementally, keyed on tasks.updated_at, at most once per
+ACCESS_INDEX_SYNC_SECONDS.
+"""
+import os
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import database
+import models
+from executor import run_blocking
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+# Seconds between full background rebuilds of the index
+ACCESS_INDEX_TTL = int(os.getenv("ACCESS_INDEX_TTL", "60"))
+# Seconds between checks for tasks whose updated_at moved (created, revoked,
+# completed in the dashboard); at most one indexed query per interval
+ACCESS_INDEX_SYNC_SECONDS = float(os.getenv("ACCESS_INDEX_SYNC_SECONDS", "1.0"))
+# Tasks updated this close to the newest updated_at seen are looked at again,
+# so a transaction that commits late (older timestamp) is not missed
+ACCESS_INDEX_DELTA_OVERLAP = timedelta(seconds=5)
+
+
+@dataclass(frozen=True)
+class AuthorizedTask:
+    id: int
+    title: Optional[str]
+    start_time: datetime
+    end_time: datetime
+    gate_ids: FrozenSet[int]  # Gate.id values authorized for this task
+
+    def is_currently_valid(self, now: datetime) -> bool:
+        return self.start_time <= now <= self.end_time
+
+
+@dataclass(frozen=True)
+class GateInfo:
+    id: int
+    gate_id: str
+    name: str
+
+
+class AccessIndex:
+    """
+    Active tasks keyed by vendor-PIC pair. Built in full on a timer; tasks
+    created, revoked or completed since are picked up by an updated_at delta
+    run at most every ACCESS_INDEX_SYNC_SECONDS, so lookups stay in memory.
+    """
+
+    def __init__(self, ttl_seconds: int = ACCESS_INDEX_TTL, sync_seconds: float = ACCESS_INDEX_SYNC_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()  # Single-flight rebuilds, deltas and gate reloads
+        # Swapped as a whole, never mutated in place
+        self._pairs: Dict[Tuple[int, int], List[AuthorizedTask]] = {}
+        self._task_pairs: Dict[int, List[Tuple[int, int]]] = {}  # Task id -> pairs it is listed under
+        self._gates: Dict[str, GateInfo] = {}
+        self._watermark: Optional[datetime] = None  # Newest tasks.updated_at applied
+        # (task id -> updated_at) already applied inside the overlap window
+        self._applied: Dict[int, datetime] = {}
+        self._built_at: Optional[float] = None
+        self._synced_at = 0.0
+
+    @staticmethod
+    def _task_query(db: Session):
+        return db.query(
+            models.Task.id, models.Task.title, models.Task.pic_id, models.Task.status,
+            models.Task.start_time, models.Task.end_time, models.Task.updated_at
+        )
+
+    @staticmethod
+    def _load_gates(db: Session) -> Dict[str, GateInfo]:
+        return {
+            gate_id: GateInfo(id=pk, gate_id=gate_id, name=name)
+            for pk, gate_id, name in db.query(models.Gate.id, models.Gate.gate_id, models.Gate.name)
+        }
+
+    @staticmethod
+    def _authorize(db: Session, tasks, now: datetime) -> Dict[int, Tuple[List[Tuple[int, int]], AuthorizedTask]]:
+        """Gates and vendor-PIC pairs of the tasks that can still grant access (2 queries)"""
+        live = [t for t in tasks if t.status == 'active' and t.end_time >= now]
+        if not live:
+            return {}
+        task_ids = [t.id for t in live]
+
+        gate_ids_by_task: Dict[int, set] = {}
+        for task_id, gate_pk in db.query(
+            models.gate_task.c.task_id, models.gate_task.c.gate_id
+        ).filter(models.gate_task.c.task_id.in_(task_ids)):
+            gate_ids_by_task.setdefault(task_id, set()).add(gate_pk)
+
+        pairs_by_task: Dict[int, List[Tuple[int, int]]] = {}
+        pic_by_task = {t.id: t.pic_id for t in live}
+        for task_id, vendor_id in db.query(
+            models.task_vendor.c.task_id, models.task_vendor.c.vendor_id
+        ).filter(models.task_vendor.c.task_id.in_(task_ids)):
+            pairs_by_task.setdefault(task_id, []).append((vendor_id, pic_by_task[task_id]))
+
+        return {
+            t.id: (pairs_by_task.get(t.id, []), AuthorizedTask(
+                id=t.id,
+                title=t.title,
+                start_time=t.start_time,
+                end_time=t.end_time,
+                gate_ids=frozenset(gate_ids_by_task.get(t.id, ())),
+            ))
+            for t in live
+        }
+
+    def refresh(self, db: Session):
+        """Rebuild from every active task that hasn't ended yet (5 queries)"""
+        now = datetime.now()
+        # Read before the tasks: anything updated in between is picked up by the next delta
+        watermark = db.query(func.max(models.Task.updated_at)).scalar()
+        tasks = self._task_query(db).filter(
+            models.Task.status == 'active',
+            models.Task.end_time >= now
+        ).all()
+        gates = self._load_gates(db)
+
+        pairs: Dict[Tuple[int, int], List[AuthorizedTask]] = {}
+        task_pairs: Dict[int, List[Tuple[int, int]]] = {}
+        for task_id, (keys, task) in self._authorize(db, tasks, now).items():
+            task_pairs[task_id] = keys
+            for key in keys:
+                pairs.setdefault(key, []).append(task)
+
+        self._pairs, self._task_pairs, self._gates = pairs, task_pairs, gates
+        self._watermark = watermark
+        horizon = watermark - ACCESS_INDEX_DELTA_OVERLAP if watermark else None
+        self._applied = {t.id: t.updated_at for t in tasks if horizon and t.updated_at and t.updated_at >= horizon}
+        self._built_at = self._synced_at = time.monotonic()
+
+    def _apply_changes(self, db: Session):
+        """Re-index tasks whose updated_at moved (1 query when nothing changed)"""
+        query = self._task_query(db)
+        if self._watermark is not None:
+            query = query.filter(models.Task.updated_at >= self._watermark - ACCESS_INDEX_DELTA_OVERLAP)
+        else:
+            query = query.filter(models.Task.updated_at.isnot(None))
+        # The overlap window re-reads rows; only act on ones not applied yet
+        changed = [t for t in query if self._applied.get(t.id) != t.updated_at]
+        if not changed:
+            return
+
+        authorized = self._authorize(db, changed, datetime.now())
+        pairs = dict(self._pairs)
+        task_pairs = dict(self._task_pairs)
+        for t in changed:
+            for key in task_pairs.pop(t.id, ()):
+                remaining = [task for task in pairs.get(key, ()) if task.id != t.id]
+                if remaining:
+                    pairs[key] = remaining
+                else:
+                    pairs.pop(key, None)
+        for task_id, (keys, task) in authorized.items():
+            task_pairs[task_id] = keys
+            for key in keys:
+                pairs[key] = pairs.get(key, []) + [task]
+
+        self._pairs, self._task_pairs = pairs, task_pairs
+        newest = max(t.updated_at for t in changed)
+        if self._watermark is None or newest > self._watermark:
+            self._watermark = newest
+        horizon = self._watermark - ACCESS_INDEX_DELTA_OVERLAP
+        applied = {task_id: at for task_id, at in self._applied.items() if at >= horizon}
+        applied.update((t.id, t.updated_at) for t in changed)
+        self._applied = applied
+
+    def sync(self, db: Session):
+        """
+        Bring the index up to date with the tasks table. Call once per PIC
+        scan, before validate_pair; queries at most every sync_seconds.
+        """
+        if self._built_at is not None and time.monotonic() - self._synced_at < self.sync_seconds:
+            return
+        with self._lock:
+            if self._built_at is None:
+                self.refresh(db)
+            elif time.monotonic() - self._synced_at >= self.sync_seconds:
+                self._apply_changes(db)
+                self._synced_at = time.monotonic()
+
+    def _gate(self, db: Session, door_id: str) -> Optional[GateInfo]:
+        """Gate by gate_id, reloading the gates once on a miss (e.g. a gate added in the dashboard)"""
+        gate = self._gates.get(door_id)
+        if gate is not None:
+            return gate
+        gates = self._gates
+        with self._lock:
+            if self._gates is gates:  # Nobody reloaded while we waited
+                self._gates = self._load_gates(db)
+        return self._gates.get(door_id)
+
+    def _refresh_with_new_session(self):
+        db = database.SessionLocal()
+        try:
+            with self._lock:
+                self.refresh(db)
+        finally:
+            db.close()
+
+    async def refresh_loop(self):
+        """Background task: rebuild the index every ACCESS_INDEX_TTL seconds"""
+        while True:
+            await asyncio.sleep(self.ttl_seconds)
+            try:
+                await run_blocking(self._refresh_with_new_session)
+            except Exception as e:
+                print(f"[ACCESS INDEX] Refresh failed: {e}")
+
+    def validate_pair(
+        self,
+        db: Session,
+        vendor_id: int,
+        pic_id: int,
+        door_id: Optional[str] = None
+    ) -> Tuple[bool, Optional[AuthorizedTask], str]:
+        """
+        Is there a task letting this vendor-PIC pair in right now (and, when
+        door_id names a gate, through that gate)? Answered from memory; call
+        sync() first. db is only used to reload the gates on a cache miss.
+        Returns: (is_valid, task, reason)
+        """
+        now = datetime.now()
+        candidates = [t for t in self._pairs.get((vendor_id, pic_id), ()) if t.is_currently_valid(now)]
+        if not candidates:
+            return False, None, "No active task found for this vendor-PIC pair at current time"
+
+        gate = self._gate(db, door_id) if door_id else None
+        if gate is None:
+            return True, candidates[0], "OK"
+
+        for task in candidates:
+            if gate.id in task.gate_ids:
+                return True, task, "OK"
+        return False, candidates[0], f"Gate '{gate.name}' is not authorized for this task"
+
+
+# Global access index instance
+access_index = AccessIndex()
@@ -0,0 +1,134 @@
+"""
+Audit Writer - Buffered, batched writer for audit_logs
+Access decisions enqueue their audit row and return immediately; a
+background thread bulk-inserts rows in batches, flushed on size or time.
+"""
+import os
+import time
+import queue
+import threading
+from typing import List
+
+from dotenv import load_dotenv
+from sqlalchemy import insert
+
+import database
+import models
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))  # Seconds
+# How long a producer blocks on a full queue before writing its row inline
+AUDIT_ENQUEUE_TIMEOUT = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT", "0.5"))
+
+
+class AuditWriter:
+    """Bounded queue of audit rows drained by a single worker thread"""
+
+    def __init__(
+        self,
+        max_queue: int = AUDIT_QUEUE_SIZE,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        enqueue_timeout: float = AUDIT_ENQUEUE_TIMEOUT,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.inline_writes = 0  # Rows written by producers because the queue was full
+
+    def start(self):
+        """Start the background worker"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker and flush everything still queued"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(remaining), self.batch_size):
+            self._write(remaining[start:start + self.batch_size])
+
+    def submit(self, row: dict):
+        """
+        Queue an audit row. When the queue is full the caller blocks for up to
+        AUDIT_ENQUEUE_TIMEOUT, then writes the row itself (backpressure).
+        """
+        if self._thread is None:
+            self._write([row])
+            return
+        try:
+            self._queue.put(row, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self.inline_writes += 1
+            self._write([row])
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            # Collect until the batch is full or the flush interval elapses
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, rows: List[dict]):
+        if not rows:
+            return
+        db = database.SessionLocal()
+        try:
+            db.execute(insert(models.AuditLog), rows)
+            db.commit()
+            with self._stats_lock:
+                self.written += len(rows)
+        except Exception as e:
+            db.rollback()
+            with self._stats_lock:
+                self.failed += len(rows)
+            print(f"[AUDIT] Failed to write {len(rows)} audit rows: {e}")
+        finally:
+            db.close()
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "written": self.written,
+                "failed": self.failed,
+                "inline_writes": self.inline_writes,
+            }
+
+
+# Global audit writer instance
+audit_writer = AuditWriter()
@@ -1,32 +1,93 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import and_, exists, select
 from datetime import datetime
 import models, schemas
+import os
 import json
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 import cv2
 try:
     import insightface
     from insightface.app import FaceAnalysis
+    from insightface.app.common import Face
     FACE_APP = None  # Lazy load
 except ImportError:
     insightface = None
     FACE_APP = None
 
 from embedding_utils import cosine_similarity
+from gallery_index import gallery_index
+from audit_writer import audit_writer
 import io
 from PIL import Image
 
 SIMILARITY_THRESHOLD = 0.40  # InsightFace typically uses lower threshold (0.3-0.5)
 
+# Embeddings computed from stored face images for users without a persisted vector
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "256"))
+_EMBEDDING_CACHE: "OrderedDict[tuple[int, str], np.ndarray]" = OrderedDict()
+_EMBEDDING_CACHE_LOCK = threading.Lock()
+
+# Only the models Sentinel uses (landmarks and genderage are never read)
+FACE_ALLOWED_MODULES = [m.strip() for m in os.getenv("FACE_ALLOWED_MODULES", "detection,recognition").split(",") if m.strip()]
+# Full detector input size, and the cheaper first-pass size (0 = always full size)
+FACE_DET_SIZE = int(os.getenv("FACE_DET_SIZE", "640"))
+FACE_DET_SIZE_MIN = int(os.getenv("FACE_DET_SIZE_MIN", "320"))
+FACE_REFINE_MARGIN = 0.5  # Crop around a candidate, as a fraction of its size
+
 def get_face_app():
     """Lazy load the face analysis app"""
     global FACE_APP
     if FACE_APP is None and insightface is not None:
-        FACE_APP = FaceAnalysis(providers=['CPUExecutionProvider'])
-        FACE_APP.prepare(ctx_id=0, det_size=(640, 640))
+        FACE_APP = FaceAnalysis(providers=['CPUExecutionProvider'], allowed_modules=FACE_ALLOWED_MODULES or None)
+        FACE_APP.prepare(ctx_id=0, det_size=(FACE_DET_SIZE, FACE_DET_SIZE))
     return FACE_APP
 
+def detect_faces_adaptive(det_model, image: np.ndarray):
+    """
+    Detect at FACE_DET_SIZE_MIN first, then re-detect in a crop around each
+    candidate so keypoints (used for alignment) keep full precision. Images
+    with no face at low resolution get one full-size pass for small faces.
+    Returns (bboxes, kpss) in image coordinates, like det_model.detect.
+    """
+    full = (FACE_DET_SIZE, FACE_DET_SIZE)
+    if not FACE_DET_SIZE_MIN or FACE_DET_SIZE_MIN >= FACE_DET_SIZE:
+        return det_model.detect(image, input_size=full, max_num=0, metric='default')
+
+    bboxes, kpss = det_model.detect(image, input_size=(FACE_DET_SIZE_MIN, FACE_DET_SIZE_MIN), max_num=0, metric='default')
+    if bboxes.shape[0] == 0:
+        return det_model.detect(image, input_size=full, max_num=0, metric='default')
+
+    height, width = image.shape[:2]
+    refined_boxes, refined_kps = [], []
+    for i, box in enumerate(bboxes):
+        x1, y1, x2, y2 = box[:4]
+        mx, my = (x2 - x1) * FACE_REFINE_MARGIN, (y2 - y1) * FACE_REFINE_MARGIN
+        cx1, cy1 = max(0, int(x1 - mx)), max(0, int(y1 - my))
+        cx2, cy2 = min(width, int(x2 + mx)), min(height, int(y2 + my))
+        crop = image[cy1:cy2, cx1:cx2]
+        # Detector input just large enough for the crop's native resolution
+        size = min(FACE_DET_SIZE, max(64, -(-max(crop.shape[:2]) // 32) * 32))
+        crop_boxes, crop_kps = det_model.detect(crop, input_size=(size, size), max_num=0, metric='default')
+        if crop_boxes.shape[0] == 0:
+            refined_boxes.append(box)
+            refined_kps.append(kpss[i] if kpss is not None else None)
+            continue
+        best = int(np.argmax(crop_boxes[:, 4]))
+        refined = crop_boxes[best].copy()
+        refined[[0, 2]] += cx1
+        refined[[1, 3]] += cy1
+        refined_boxes.append(refined)
+        refined_kps.append(crop_kps[best] + (cx1, cy1) if crop_kps is not None else None)
+
+    if any(k is None for k in refined_kps):
+        return np.stack(refined_boxes), None
+    return np.stack(refined_boxes), np.stack(refined_kps)
+
 def get_embedding_from_b64(b64_str: str):
     """
     Decodes a base64 image string and generates face embedding using InsightFace.
@@ -53,27 +114,61 @@ def get_embedding_from_b64(b64_str: str):
         if app is None:
             return None
             
-        # Detect faces and get embeddings
-        faces = app.get(image_bgr)
-        if len(faces) > 0:
-            # Return the embedding of the first detected face
-            return faces[0].embedding
-        return None
+        # Detect faces, then embed only the most confident one
+        bboxes, kpss = detect_faces_adaptive(app.det_model, image_bgr)
+        if bboxes.shape[0] == 0:
+            return None
+        best = int(np.argmax(bboxes[:, 4]))
+        face = Face(bbox=bboxes[best, 0:4], kps=kpss[best] if kpss is not None else None, det_score=bboxes[best, 4])
+        app.models['recognition'].get(image_bgr, face)
+        return face.embedding
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return None
 
+def get_stored_embedding(user: models.User):
+    """
+    Returns the reference embedding for a user.
+    Uses the persisted embedding when present; otherwise derives it from
+    face_image once and keeps it in a bounded LRU cache keyed by
+    (user id, image hash) so a changed photo is never served stale.
+    """
+    stored = user.get_face_embedding()
+    if stored is not None:
+        return stored
+    if not user.face_image:
+        return None
+
+    key = (user.id, hashlib.sha1(user.face_image.encode()).hexdigest())
+    with _EMBEDDING_CACHE_LOCK:
+        if key in _EMBEDDING_CACHE:
+            _EMBEDDING_CACHE.move_to_end(key)
+            return _EMBEDDING_CACHE[key]
+
+    embedding = get_embedding_from_b64(user.face_image)
+    if embedding is None:
+        return None
+
+    with _EMBEDDING_CACHE_LOCK:
+        _EMBEDDING_CACHE[key] = embedding
+        _EMBEDDING_CACHE.move_to_end(key)
+        while len(_EMBEDDING_CACHE) > EMBEDDING_CACHE_SIZE:
+            _EMBEDDING_CACHE.popitem(last=False)
+    return embedding
+
 def verify_identity(user: models.User, incoming_embedding: list[float]) -> tuple[bool, float]:
     """
-    Verifies if the incoming embedding matches the user's stored face image.
+    Verifies if the incoming embedding matches the user's stored face.
     """
-    if not user.face_image or not incoming_embedding:
-        return True, 1.0  # Skip if no data (fallback to ID trust)
+    if incoming_embedding is None or len(incoming_embedding) == 0:
+        return True, 1.0  # Nothing to verify against (fallback to ID trust)
 
-    # 1. Generate embedding from stored DB image
-    stored_embedding = get_embedding_from_b64(user.face_image)
+    # 1. Get the reference embedding (persisted vector, or cached from image)
+    stored_embedding = get_stored_embedding(user)
     
     if stored_embedding is None:
+        if not user.face_image:
+            return True, 1.0  # User has no face data at all (fallback to ID trust)
         if insightface is None:
             # Bypass verification if library is missing
             return True, 1.0
@@ -86,6 +181,10 @@ def verify_identity(user: models.User, incoming_embedding: list[float]) -> tuple
     return score > SIMILARITY_THRESHOLD, score
 
 def log_access(db: Session, vendor: models.User, pic: models.User, gate: models.Gate, task: models.Task, success: bool, reason: str, ip: str, similarity: float = None):
+    """
+    Queue an access audit row. The row is bulk-inserted by the audit writer,
+    so the access response never waits on the audit commit.
+    """
     details = {
         'vendor_id': vendor.id if vendor else None,
         'pic_id': pic.id if pic else None,
@@ -94,19 +193,19 @@ def log_access(db: Session, vendor: models.User, pic: models.User, gate: models.
         'similarity_score': str(similarity) if similarity is not None else None
     }
     
-    log = models.AuditLog(
-        action='access_validated',
-        entity_type='access_request',
-        entity_id=None,
-        user_id=None, 
-        details=details,
-        ip_address=ip,
-        success=success,
-        reason=reason,
-        created_at=datetime.now()
-    )
-    db.add(log)
-    db.commit()
+    now = datetime.now()
+    audit_writer.submit({
+        'action': 'access_validated',
+        'entity_type': 'access_request',
+        'entity_id': None,
+        'user_id': None,
+        'details': details,
+        'ip_address': ip,
+        'success': success,
+        'reason': reason,
+        'created_at': now,
+        'updated_at': now,
+    })
 
 
 def get_user_by_id(db: Session, user_id: int):
@@ -121,47 +220,100 @@ def get_user_by_name(db: Session, name: str):
 
 def identify_user(db: Session, embedding: list[float], threshold: float = 0.45):
     """
-    Iterates through all users with stored embeddings and finds the best match.
-    Note: For large scale, use a vector DB (Milvus/Faiss). This is O(N).
+    Finds the best match among all users with stored embeddings.
+    Scoring runs against the resident gallery index (one matrix-vector product),
+    only the matched user row is loaded from the database.
     """
-    if not embedding:
+    if embedding is None or len(embedding) == 0:
         return None, 0.0
 
-    users = db.query(models.User).filter(models.User.face_embedding.isnot(None)).all()
-    best_match = None
-    best_score = -1.0
+    user_id, _, best_score = gallery_index.search(db, embedding)
+    if user_id is None or best_score <= threshold:
+        return None, best_score
 
-    target_embedding = np.array(embedding)
+    user = get_user_by_id(db, user_id)
+    if user is None or not user.face_embedding_vector:
+        # Deleted or reset from the dashboard since the index was built
+        gallery_index.invalidate()
+        return None, best_score
 
-    for user in users:
-        stored_emb = user.face_embedding
-        if stored_emb is None:
-            continue
+    return user, best_score
 
-        stored_emb_np = np.array(stored_emb)
-        score = cosine_similarity(stored_emb_np, target_embedding)
-        if score > best_score:
-            best_score = score
-            best_match = user
-            
-    if best_score > threshold:
-        return best_match, best_score
-        
-    return None, best_score
+
+def identify_users(db: Session, embeddings: list[list[float]], threshold: float = 0.45):
+    """
+    Batch version of identify_user for frames with several faces.
+    All queries are scored in one matrix-matrix product and the matched
+    users are loaded with a single query.
+    Returns a list of (user or None, score), one per embedding.
+    """
+    if embeddings is None or len(embeddings) == 0:
+        return []
+
+    matches = gallery_index.search_batch(db, embeddings)
+    matched_ids = {user_id for user_id, _, score in matches if user_id is not None and score > threshold}
+    users = {}
+    if matched_ids:
+        users = {
+            u.id: u for u in db.query(models.User).filter(models.User.id.in_(matched_ids)).all()
+            if u.face_embedding_vector
+        }
+        if len(users) != len(matched_ids):
+            gallery_index.invalidate()
+
+    results = []
+    for user_id, _, score in matches:
+        if user_id is not None and score > threshold and user_id in users:
+            results.append((users[user_id], score))
+        else:
+            results.append((None, score))
+    return results
+
+
+def backfill_embedding_vectors(db: Session) -> int:
+    """
+    Pack legacy JSON embeddings into face_embedding_vector for rows that
+    don't have one yet (e.g. seeded or written by an older server); the
+    JSON copy is dropped once packed.
+    """
+    users = db.query(models.User).filter(
+        models.User.face_embedding_vector.is_(None),
+        models.User.face_embedding.isnot(None)
+    ).all()
+
+    count = 0
+    for user in users:
+        if user.face_embedding:
+            user.set_face_embedding(user.face_embedding)
+            count += 1
+    if count:
+        db.commit()
+    return count
 
 
 def validate_access(db: Session, request: schemas.AccessValidateRequest, ip_address: str):
     """
     Validate access based on vendor_id and pic_id (user IDs).
+    Everything is fetched in two statements: both users, then the gate
+    outer-joined to the pair's active tasks with gate authorization resolved
+    in SQL. Tasks covering this gate are considered first, so the task that
+    is approved or logged on a denial is one authorizing the gate whenever
+    the pair has one.
     """
+    users = {
+        u.id: u for u in db.query(models.User).filter(
+            models.User.id.in_({request.vendor_id, request.pic_id})
+        )
+    }
+
     # Step 1: Verify vendor exists
-    vendor = get_user_by_id(db, request.vendor_id)
+    vendor = users.get(request.vendor_id)
     if not vendor:
         return {"approved": False, "reason": "Vendor not found", "similarity": 0.0}
 
     # Verify Vendor Identity (Embedding Match)
-    if request.vendor_embedding:
-        is_match, score = verify_identity(vendor, request.vendor_embedding)
+    if request.vendor_vector() is not None:
+        is_match, score = verify_identity(vendor, request.vendor_vector())
         if not is_match:
             log_access(db, vendor, None, None, None, False, f"Vendor face mismatch (Score: {score:.2f})", ip_address, score)
             return {"approved": False, "reason": "Vendor face verification failed", "similarity": score}
@@ -172,14 +324,14 @@ def validate_access(db: Session, request: schemas.AccessValidateRequest, ip_addr
         return {"approved": False, "reason": "Invalid vendor role"}
 
     # Step 3: Verify PIC exists
-    pic = get_user_by_id(db, request.pic_id)
+    pic = users.get(request.pic_id)
     if not pic:
         log_access(db, vendor, None, None, None, False, "PIC not found", ip_address)
         return {"approved": False, "reason": "PIC not found"}
 
     # Verify PIC Identity (Embedding Match)
-    if request.pic_embedding:
-        is_match, score = verify_identity(pic, request.pic_embedding)
+    if request.pic_vector() is not None:
+        is_match, score = verify_identity(pic, request.pic_vector())
         if not is_match:
             log_access(db, vendor, pic, None, None, False, f"PIC face mismatch (Score: {score:.2f})", ip_address, score)
             return {"approved": False, "reason": "PIC face verification failed", "similarity": score}
@@ -189,61 +341,57 @@ def validate_access(db: Session, request: schemas.AccessValidateRequest, ip_addr
         log_access(db, vendor, pic, None, None, False, "Invalid PIC role", ip_address)
         return {"approved": False, "reason": "Invalid PIC role"}
 
-    # Step 5: Verify Gate exists
-    gate = db.query(models.Gate).filter(models.Gate.gate_id == request.gate_id).first()
-    if not gate:
+    # Step 5: Fetch the gate together with the active tasks where the vendor
+    # is assigned and the PIC matches, flagging whether each authorizes it
+    pair_tasks = select(models.task_vendor.c.task_id).where(
+        models.task_vendor.c.vendor_id == vendor.id
+    )
+    gate_authorized = exists().where(and_(
+        models.gate_task.c.task_id == models.Task.id,
+        models.gate_task.c.gate_id == models.Gate.id
+    )).label("gate_authorized")
+    rows = db.query(models.Gate, models.Task, gate_authorized).outerjoin(
+        models.Task,
+        and_(
+            models.Task.id.in_(pair_tasks),
+            models.Task.pic_id == pic.id,
+            models.Task.status == 'active'
+        )
+    ).filter(models.Gate.gate_id == request.gate_id).all()
+
+    if not rows:
         log_access(db, vendor, pic, None, None, False, "Gate not found", ip_address)
         return {"approved": False, "reason": "Gate not found"}
+    gate = rows[0][0]
 
     # Step 6: Verify Gate active
     if not gate.is_active:
         log_access(db, vendor, pic, gate, None, False, "Gate is inactive", ip_address)
         return {"approved": False, "reason": "Gate is inactive"}
 
-    # Step 7: Find Active Task where vendor is assigned and PIC matches
-    task = db.query(models.Task).filter(
-        models.Task.vendors.any(id=vendor.id),  # Check if vendor is in the vendors list
-        models.Task.pic_id == pic.id,
-        models.Task.status == 'active'
-    ).first()
-
-    if not task:
+    # Step 7: Verify an active task exists (tasks covering this gate first)
+    tasks = sorted(
+        ((task, bool(authorized)) for _, task, authorized in rows if task is not None),
+        key=lambda row: not row[1]
+    )
+    if not tasks:
         log_access(db, vendor, pic, gate, None, False, "No active task found", ip_address)
         return {"approved": False, "reason": "No active task found for this vendor-PIC pair"}
 
 
     # Step 8: Verify Time Window
     now = datetime.now()
-    if not (task.start_time <= now <= task.end_time):
-        log_access(db, vendor, pic, gate, task, False, "Task outside time window", ip_address)
+    in_window = [(task, authorized) for task, authorized in tasks if task.start_time <= now <= task.end_time]
+    if not in_window:
+        log_access(db, vendor, pic, gate, tasks[0][0], False, "Task outside time window", ip_address)
         return {"approved": False, "reason": "Task is outside valid time window"}
 
     # Step 9: Verify Gate Authorization
-    if gate not in task.gates:
+    task, authorized = in_window[0]
+    if not authorized:
         log_access(db, vendor, pic, gate, task, False, "Gate not authorized", ip_address)
         return {"approved": False, "reason": "Gate not authorized for this task"}
 
     # Success!
     log_access(db, vendor, pic, gate, task, True, "OK", ip_address)
     return {"approved": True, "reason": "OK"}
-
-
-def update_gate_heartbeat(db: Session, device_id: str) -> dict:
-    """
-    Update a gate's heartbeat timestamp and integration status.
-    Called by client devices to indicate they are online.
-    """
-    from zoneinfo import ZoneInfo
-    
-    gate = db.query(models.Gate).filter(models.Gate.door_id == device_id).first()
-    
-    if not gate:
-        return {"success": False, "error": f"Gate not found for device_id: {device_id}"}
-    
-    # Use Asia/Jakarta timezone to match Laravel app
-    jakarta_tz = ZoneInfo("Asia/Jakarta")
-    gate.last_heartbeat_at = datetime.now(jakarta_tz)
-    gate.integration_status = "integrated"
-    db.commit()
-    
-    return {"success": True, "gate_id": gate.id, "gate_name": gate.name}
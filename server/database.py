@@ -1,6 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 import os
+import time
+import threading
 from dotenv import load_dotenv
 
 # Load .env from current directory (server/)
@@ -13,6 +16,17 @@ DB_DATABASE = os.getenv("DB_DATABASE", "sentinel")
 DB_USERNAME = os.getenv("DB_USERNAME", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 
+# Connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Keep below MySQL wait_timeout
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# SQLite (file shared with Laravel)
+SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() in ("1", "true", "yes")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
 # SQLAlchemy Connection URL
 if DB_CONNECTION == "sqlite":
     # For SQLite, use the same database as Laravel (web/)
@@ -27,14 +41,57 @@ if DB_CONNECTION == "sqlite":
         db_path = os.path.join(project_root, "web", "database", DB_DATABASE)
         SQLALCHEMY_DATABASE_URL = f"sqlite:///{db_path}"
     
-    # SQLite requires strict thread management usually, but for dev checks:
-    connect_args = {"check_same_thread": False}
+    # Connections are handed between threads by the pool, never shared concurrently
+    connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
 else:
     # MySQL
     SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DATABASE}"
     connect_args = {}
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self._wait_lock:
+                self.wait_count += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args=connect_args,
+    poolclass=MeteredQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+if DB_CONNECTION == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        if SQLITE_WAL:
+            # Readers no longer block on Laravel's writes (and vice versa)
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -45,3 +102,23 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def pool_metrics() -> dict:
+    """Snapshot of connection pool usage for sizing DB_POOL_SIZE/DB_MAX_OVERFLOW"""
+    pool = engine.pool
+    metrics = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),  # SQLAlchemy reports idle capacity as negative
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+    if isinstance(pool, MeteredQueuePool):
+        with pool._wait_lock:
+            metrics.update({
+                "wait_count": pool.wait_count,
+                "wait_avg_ms": round(pool.wait_total / pool.wait_count * 1000, 3) if pool.wait_count else 0.0,
+                "wait_max_ms": round(pool.wait_max * 1000, 3),
+            })
+    return metrics
@@ -0,0 +1,106 @@
+"""
+Door Registry - Maps gates to their door lock devices
+Cached in memory from the gates table so each unlock resolves the session's
+gate to its device URL without a database round trip.
+"""
+import os
+import time
+import threading
+from typing import Dict, Optional, Set
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+import database
+import models
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+# Seconds before the cached gate -> device mapping is rebuilt
+DOOR_REGISTRY_TTL = int(os.getenv("DOOR_REGISTRY_TTL", "30"))
+# Minimum seconds between rebuilds forced by a door_id the cache doesn't know
+DOOR_REGISTRY_MISS_REFRESH = float(os.getenv("DOOR_REGISTRY_MISS_REFRESH", "2"))
+
+
+def _device_url(address: str) -> str:
+    """Gates store a bare IP (optionally with port); the client needs a URL"""
+    address = address.strip().rstrip("/")
+    if "://" not in address:
+        address = f"http://{address}"
+    return address
+
+
+class DoorRegistry:
+    """door_id / gate_id -> device base URL, rebuilt on a TTL and on unknown ids"""
+
+    def __init__(self, ttl_seconds: int = DOOR_REGISTRY_TTL, miss_refresh: float = DOOR_REGISTRY_MISS_REFRESH):
+        self.ttl_seconds = ttl_seconds
+        self.miss_refresh = miss_refresh
+        self._lock = threading.Lock()  # Single-flight rebuilds
+        self._devices: Dict[str, str] = {}
+        self._known: Set[str] = set()  # Every gate_id / door_id, with or without a device
+        self._built_at: Optional[float] = None
+        self._miss_refreshed_at: Optional[float] = None  # Last rebuild forced by an unknown id
+
+    def refresh(self, db: Session):
+        """Rebuild the mapping from every active gate with a device address"""
+        devices, known = {}, set()
+        rows = db.query(
+            models.Gate.gate_id, models.Gate.door_id, models.Gate.door_ip_address, models.Gate.is_active
+        )
+        for gate_id, door_id, address, is_active in rows:
+            known.update(key for key in (gate_id, door_id) if key)
+            if is_active is False or not address or not address.strip():
+                continue
+            url = _device_url(address)
+            # Sessions carry the client's DEVICE_ID, which is normally the gate's
+            # door_id; gate_id is accepted too for older clients
+            if gate_id:
+                devices.setdefault(gate_id, url)
+            if door_id:
+                devices[door_id] = url
+        self._devices, self._known = devices, known
+        self._built_at = time.monotonic()
+
+    def _is_stale(self) -> bool:
+        return self._built_at is None or time.monotonic() - self._built_at > self.ttl_seconds
+
+    def _refresh_with_new_session(self):
+        db = database.SessionLocal()
+        try:
+            self.refresh(db)
+        except Exception as e:
+            print(f"[DOORS] Registry refresh failed, using cached mapping: {e}")
+        finally:
+            db.close()
+
+    def _miss_refresh_due(self) -> bool:
+        return self._miss_refreshed_at is None or time.monotonic() - self._miss_refreshed_at > self.miss_refresh
+
+    def resolve(self, door_id: Optional[str]) -> Optional[str]:
+        """
+        Device URL for a session's gate, or None if the gate has no device
+        address (or doesn't exist). A door_id the cache doesn't know, e.g. a
+        gate just added in the dashboard, forces a (rate-limited) rebuild
+        first, so it is never mistaken for a gate without a device.
+        """
+        if not door_id:
+            return None
+        if self._is_stale():
+            with self._lock:
+                if self._is_stale():
+                    self._refresh_with_new_session()
+        if door_id not in self._known and self._miss_refresh_due():
+            with self._lock:
+                if door_id not in self._known and self._miss_refresh_due():
+                    self._miss_refreshed_at = time.monotonic()
+                    self._refresh_with_new_session()
+        return self._devices.get(door_id)
+
+    def invalidate(self):
+        """Force a rebuild on the next lookup (e.g. after a gate was changed)"""
+        self._built_at = None
+
+
+# Global door registry instance
+door_registry = DoorRegistry()
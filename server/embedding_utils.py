@@ -1,24 +1,50 @@
-import base64
-from typing import List
+import os
+from typing import Optional
 import numpy as np
 
+# Dimension of stored face embeddings (buffalo_l ArcFace = 512)
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "512"))
+# dtype used for the binary users.face_embedding_vector column: float32 or float16
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
 def normalize(v: np.ndarray) -> np.ndarray:
     norm = np.linalg.norm(v)
     if norm == 0:
         return v
     return v / norm
 
-def encode_embedding(vec: List[float]) -> bytes:
-    arr = np.asarray(vec, dtype=np.float32)
-    arr = normalize(arr)
-    return base64.b64encode(arr.tobytes())
+def pack_embedding(vec, dtype: str = EMBEDDING_STORAGE_DTYPE) -> bytes:
+    """Serialize a normalized embedding to raw little-endian bytes for the binary column"""
+    arr = normalize(np.asarray(vec, dtype=np.float32).ravel())
+    return arr.astype(np.dtype(dtype).newbyteorder("<")).tobytes()
+
+def unpack_embedding(blob: bytes, dim: int = EMBEDDING_DIM) -> Optional[np.ndarray]:
+    """
+    Zero-copy view of a packed embedding. The dtype is inferred from the blob
+    size, so float32 and float16 rows can coexist.
+    """
+    if not blob:
+        return None
+    itemsize = len(blob) // dim if dim else 4
+    if itemsize == 2:
+        return np.frombuffer(blob, dtype="<f2")
+    return np.frombuffer(blob, dtype="<f4")
+
+# Compact wire encodings accepted for embeddings sent by clients
+WIRE_DTYPES = {"float32": "<f4", "float16": "<f2"}
 
-def decode_embedding(blob: bytes, dim: int) -> np.ndarray:
-    raw = base64.b64decode(blob)
-    arr = np.frombuffer(raw, dtype=np.float32)
-    if dim and arr.size != dim:
-        arr = arr[:dim]
-    return normalize(arr)
+def decode_wire_embeddings(raw: bytes, dtype: str = "float32", dim: Optional[int] = None) -> np.ndarray:
+    """
+    Raw little-endian floats from a request -> (n, dim) float32 array, in one
+    NumPy call instead of per-element parsing. Without dim the whole buffer is
+    a single embedding. Raises ValueError on a size mismatch.
+    """
+    wire_dtype = np.dtype(WIRE_DTYPES[dtype])
+    row_bytes = wire_dtype.itemsize * (dim or 1)
+    if not raw or len(raw) % row_bytes:
+        raise ValueError(f"{len(raw)} bytes is not a whole number of {dtype} embeddings")
+    arr = np.frombuffer(raw, dtype=wire_dtype).astype(np.float32, copy=False)
+    return arr.reshape(-1, dim) if dim else arr.reshape(1, -1)
 
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     if a.size == 0 or b.size == 0:
@@ -0,0 +1,286 @@
+"""
+Event Forwarder - Spooled, batched delivery of door access events to Laravel
+Events are queued in memory and return immediately; a spooler task appends
+them to a local JSONL spool off the event loop, and a background task POSTs
+them in batches over one keep-alive client and only advances its cursor once
+Laravel has accepted them, so a dashboard outage delays access events instead
+of losing them. Every uvicorn worker appends to
+the same spool under a file lock; whichever worker holds the sender lock
+delivers, so no batch is posted twice.
+"""
+import os
+import json
+import random
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from file_lock import FileLock
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+LARAVEL_API_URL = os.getenv("LARAVEL_API_URL", "http://127.0.0.1:8000")
+# Append-only spool of events not yet accepted by Laravel (cursor and locks kept next to it)
+EVENT_SPOOL_PATH = os.getenv(
+    "EVENT_SPOOL_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "access_events.jsonl"),
+)
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "100"))
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0"))  # Seconds
+EVENT_RETRY_MAX_BACKOFF = float(os.getenv("EVENT_RETRY_MAX_BACKOFF", "60"))  # Seconds
+
+
+class EventForwarder:
+    """Disk spool of access events drained by one async sender"""
+
+    def __init__(
+        self,
+        spool_path: str = EVENT_SPOOL_PATH,
+        batch_size: int = EVENT_BATCH_SIZE,
+        flush_interval: float = EVENT_FLUSH_INTERVAL,
+    ):
+        self.spool_path = spool_path
+        self.cursor_path = f"{spool_path}.cursor"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._spool_lock = FileLock(f"{spool_path}.lock")  # Spool and cursor, across threads and workers
+        self._queue = deque()  # Serialized events not yet appended to the spool
+        self._queued: Optional[asyncio.Event] = None
+        self._spooler: Optional[asyncio.Task] = None
+        self._sender_lock = FileLock(f"{spool_path}.sender.lock")  # One delivering worker at a time
+        self._client: Optional[httpx.AsyncClient] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.rejected = 0
+        self.failed_attempts = 0
+
+    async def start(self):
+        """Open the shared client and start draining the spool (including leftovers)"""
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        self._client = httpx.AsyncClient(
+            base_url=LARAVEL_API_URL,
+            timeout=httpx.Timeout(10.0, connect=3.0),
+            headers={"Accept": "application/json"},
+            limits=httpx.Limits(max_connections=2, max_keepalive_connections=2),
+        )
+        self._wakeup = asyncio.Event()
+        self._queued = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._spooler = asyncio.create_task(self._spool_loop())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the sender after one last delivery attempt; undelivered events stay spooled"""
+        self._loop = None  # Later submits append to the spool directly
+        if self._spooler:
+            self._spooler.cancel()
+            try:
+                await self._spooler
+            except asyncio.CancelledError:
+                pass
+            self._spooler = None
+        await asyncio.to_thread(self._append_queued)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client:
+            try:
+                await self._deliver_pending()
+            except Exception as e:
+                print(f"[LARAVEL] Final flush failed, events kept in spool: {e}")
+            await self._client.aclose()
+            self._client = None
+
+    def submit(self, event: dict):
+        """
+        Queue an event for delivery. Never touches the disk or the network
+        while the forwarder runs, so door flows can log without waiting.
+        """
+        event.setdefault("occurred_at", datetime.now().isoformat(timespec="seconds"))
+        self._queue.append(json.dumps(event, separators=(",", ":")) + "\n")
+        loop = self._loop
+        if loop is None:
+            self._append_queued()  # Not running (startup/shutdown): spool right here
+        else:
+            loop.call_soon_threadsafe(self._queued.set)
+
+    # ------------------------------------------------------------------
+    # Spool
+    # ------------------------------------------------------------------
+
+    def _append_queued(self) -> int:
+        """Append every queued event to the spool in one write (blocking)"""
+        lines = []
+        while self._queue:
+            lines.append(self._queue.popleft())
+        if not lines:
+            return 0
+        try:
+            with self._spool_lock:
+                with open(self.spool_path, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+        except Exception:
+            self._queue.extendleft(reversed(lines))  # Keep them for the next attempt
+            raise
+        return len(lines)
+
+    async def _spool_loop(self):
+        while True:
+            await self._queued.wait()
+            self._queued.clear()
+            try:
+                if await asyncio.to_thread(self._append_queued):
+                    self._wakeup.set()
+            except Exception as e:
+                print(f"[LARAVEL] Failed to spool {len(self._queue)} access events, retrying: {e}")
+                await asyncio.sleep(1.0)
+                self._queued.set()
+
+    def _read_cursor(self) -> int:
+        try:
+            with open(self.cursor_path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_cursor(self, offset: int):
+        tmp_path = f"{self.cursor_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.cursor_path)
+
+    def _read_batch(self) -> Tuple[List[dict], int]:
+        """Next batch of complete lines after the cursor, and the offset past them"""
+        events = []
+        with self._spool_lock:
+            offset = self._read_cursor()
+            if not os.path.exists(self.spool_path):
+                return [], offset
+            with open(self.spool_path, "rb") as f:
+                f.seek(offset)
+                while len(events) < self.batch_size:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break  # Nothing left, or a write still in progress
+                    offset += len(line)
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        print(f"[LARAVEL] Skipping corrupt spooled event: {line[:80]!r}")
+        return events, offset
+
+    def _advance(self, offset: int):
+        """Acknowledge events up to offset; truncate the spool once fully drained"""
+        with self._spool_lock:
+            if os.path.exists(self.spool_path) and os.path.getsize(self.spool_path) <= offset:
+                open(self.spool_path, "w").close()
+                offset = 0
+            self._write_cursor(offset)
+
+    def backlog_bytes(self) -> int:
+        try:
+            return max(0, os.path.getsize(self.spool_path) - self._read_cursor())
+        except OSError:
+            return 0
+
+    # ------------------------------------------------------------------
+    # Delivery
+    # ------------------------------------------------------------------
+
+    async def _post_batch(self, events: List[dict]) -> bool:
+        """
+        True if the batch is done with (accepted, or rejected as invalid),
+        False if it should be retried later.
+        """
+        try:
+            response = await self._client.post("/api/doors/log-access/bulk", json={"events": events})
+        except httpx.TransportError as e:
+            print(f"[LARAVEL] Failed to deliver {len(events)} access events: {e!r}")
+            return False
+
+        if response.status_code < 300:
+            body = response.json()
+            self.delivered += body.get("inserted", len(events))
+            skipped = body.get("skipped") or []
+            if skipped:
+                self.rejected += len(skipped)
+                print(f"[LARAVEL] {len(skipped)} access events skipped: {skipped}")
+            print(f"[LARAVEL] Logged {len(events)} access events: {response.status_code}")
+            return True
+        if response.status_code in (400, 422):
+            # Retrying an invalid batch would block the spool forever
+            self.rejected += len(events)
+            print(f"[LARAVEL] Dropping {len(events)} rejected access events: {response.status_code} {response.text[:200]}")
+            return True
+        print(f"[LARAVEL] Access event delivery failed: {response.status_code}")
+        return False
+
+    async def _deliver_pending(self) -> bool:
+        """
+        Send spooled batches until the spool is drained (True) or a send fails.
+        Returns True straight away while another worker is delivering.
+        """
+        if not self._sender_lock.acquire(blocking=False):
+            return True
+        try:
+            return await self._deliver_batches()
+        finally:
+            self._sender_lock.release()
+
+    async def _deliver_batches(self) -> bool:
+        while True:
+            events, offset = await asyncio.to_thread(self._read_batch)
+            if not events:
+                if offset != self._read_cursor():
+                    self._advance(offset)  # Only corrupt lines were read
+                return True
+            if not await self._post_batch(events):
+                self.failed_attempts += 1
+                return False
+            await asyncio.to_thread(self._advance, offset)
+
+    async def _run(self):
+        backoff = 0.0
+        while True:
+            if backoff:
+                await asyncio.sleep(backoff)
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+
+            try:
+                drained = await self._deliver_pending()
+            except Exception as e:
+                print(f"[LARAVEL] Access event forwarder error: {e}")
+                drained = False
+
+            if drained:
+                backoff = 0.0
+            else:
+                backoff = min(EVENT_RETRY_MAX_BACKOFF, max(1.0, backoff * 2)) * random.uniform(0.8, 1.2)
+
+    def metrics(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "backlog_bytes": self.backlog_bytes(),
+            "delivered": self.delivered,
+            "rejected": self.rejected,
+            "failed_attempts": self.failed_attempts,
+        }
+
+
+# Global event forwarder instance
+event_forwarder = EventForwarder()
@@ -0,0 +1,28 @@
+"""
+Executor - Bounded thread pool for blocking work in async endpoints
+Keeps synchronous SQLAlchemy queries and similarity scoring off the event
+loop so scans from many gates overlap instead of serializing.
+"""
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+# Keep this at or below the database pool size so workers don't queue on connections
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan-worker")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking callable on the bounded pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown():
+    """Wait for in-flight work and stop the pool"""
+    _executor.shutdown(wait=True)
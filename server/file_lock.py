@@ -0,0 +1,80 @@
+"""
+File Lock - Exclusive lock shared by threads and by other server processes
+State files under data/ (event spool, lock schedule, gallery index) are shared
+by every uvicorn worker, so a threading.Lock alone does not protect them.
+The OS drops the lock if the holding process dies.
+"""
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def _lock_fd(fd: int, blocking: bool):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        # LK_LOCK gives up after ~10 s of retries; keep waiting like flock does
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if not blocking:
+                    raise
+
+
+def _unlock_fd(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Lock on a sidecar file; usable as a context manager (blocking)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()  # flock does not exclude threads sharing a descriptor
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        try:
+            _lock_fd(fd, blocking)
+        except BaseException as e:
+            os.close(fd)
+            self._thread_lock.release()
+            if blocking or not isinstance(e, OSError):
+                raise
+            return False  # Held by another process
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        try:
+            _unlock_fd(fd)
+        finally:
+            os.close(fd)
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,499 @@
+"""
+Gallery Index - Resident face gallery for 1:N identification
+Keeps every enrolled embedding in memory behind a pluggable search backend:
+an exact NumPy matrix (one matrix-vector product plus argmax) or an
+in-process HNSW graph for large galleries. The index is saved to disk and
+reloaded at server start; uvicorn workers share the files under a file lock.
+An enrollment in one worker bumps a version stamp file that the other workers
+check (one stat) before each search, so they re-sync right away.
+"""
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+import models
+from embedding_utils import normalize, unpack_embedding
+from file_lock import FileLock
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+# Search backend: "exact" (NumPy, default) or "hnsw" (requires hnswlib)
+IDENTIFY_BACKEND = os.getenv("IDENTIFY_BACKEND", "exact").lower()
+# Base path of the persisted index (backend files and .meta.json are derived from it)
+GALLERY_INDEX_PATH = os.getenv(
+    "GALLERY_INDEX_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "gallery_index"),
+)
+# Re-sync with the database after this many seconds so changes made by the
+# Laravel dashboard (e.g. a face reset) are picked up. 0 disables the refresh.
+GALLERY_REFRESH_SECONDS = int(os.getenv("GALLERY_REFRESH_SECONDS", "300"))
+# HNSW graph parameters
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class ExactBackend:
+    """Brute-force cosine search over a pre-normalized float32 matrix"""
+
+    name = "exact"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (matrix, ids) is swapped as a whole so searches never see a
+        # half-updated gallery
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+
+    def build(self, ids: np.ndarray, matrix: np.ndarray):
+        with self._lock:
+            self._matrix = _normalize_rows(matrix) if len(ids) else np.empty((0, 0), dtype=np.float32)
+            self._ids = np.asarray(ids, dtype=np.int64)
+
+    def upsert(self, user_id: int, vec: np.ndarray):
+        with self._lock:
+            matrix, ids = self._matrix, self._ids
+            if matrix.size and matrix.shape[1] != vec.size:
+                raise ValueError(f"Embedding dimension {vec.size} does not match index ({matrix.shape[1]})")
+            hits = np.flatnonzero(ids == user_id)
+            if hits.size:
+                matrix = matrix.copy()
+                matrix[hits[0]] = vec
+            else:
+                matrix = vec[None, :] if not matrix.size else np.vstack([matrix, vec])
+                ids = np.append(ids, np.int64(user_id))
+            self._matrix, self._ids = matrix, ids
+
+    def remove(self, user_id: int):
+        with self._lock:
+            keep = self._ids != user_id
+            if not keep.all():
+                self._matrix, self._ids = self._matrix[keep], self._ids[keep]
+
+    def search(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-1 search for each row of queries. Returns (ids, scores)."""
+        matrix, ids = self._matrix, self._ids
+        if not ids.size or matrix.shape[1] != queries.shape[1]:
+            return np.full(len(queries), -1, dtype=np.int64), np.full(len(queries), -1.0)
+        scores = queries @ matrix.T
+        best = np.argmax(scores, axis=1)
+        return ids[best], scores[np.arange(len(queries)), best]
+
+    def save(self, path: str):
+        with self._lock:
+            np.savez(f"{path}.npz", matrix=self._matrix, ids=self._ids)
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(f"{path}.npz"):
+            return False
+        with np.load(f"{path}.npz") as data:
+            matrix, ids = data["matrix"], data["ids"]
+        with self._lock:
+            self._matrix, self._ids = matrix.astype(np.float32), ids.astype(np.int64)
+        return True
+
+    def __len__(self) -> int:
+        return int(self._ids.size)
+
+
+class HnswBackend:
+    """Approximate inner-product search using an hnswlib graph"""
+
+    name = "hnsw"
+
+    def __init__(self, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 ef_search: int = HNSW_EF_SEARCH):
+        if hnswlib is None:
+            raise RuntimeError("IDENTIFY_BACKEND=hnsw requires the hnswlib package")
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        # hnswlib does not allow resize/mark_deleted concurrently with queries
+        self._lock = threading.RLock()
+        self._index = None
+        self._dim = 0
+        self._live: set = set()
+        self._deleted: set = set()
+
+    def _init_index(self, dim: int, capacity: int):
+        self._index = hnswlib.Index(space="ip", dim=dim)
+        self._index.init_index(max_elements=max(capacity, 16), ef_construction=self.ef_construction,
+                               M=self.m, allow_replace_deleted=True)
+        self._index.set_ef(self.ef_search)
+        self._dim = dim
+        self._live, self._deleted = set(), set()
+
+    def _reserve(self, extra: int):
+        needed = self._index.get_current_count() + extra
+        capacity = self._index.get_max_elements()
+        if needed > capacity:
+            self._index.resize_index(max(needed, capacity * 2))
+
+    def build(self, ids: np.ndarray, matrix: np.ndarray):
+        with self._lock:
+            self._index = None
+            if not len(ids):
+                return
+            matrix = _normalize_rows(matrix)
+            self._init_index(matrix.shape[1], len(ids) * 2)
+            self._index.add_items(matrix, np.asarray(ids, dtype=np.int64))
+            self._live = {int(i) for i in ids}
+
+    def upsert(self, user_id: int, vec: np.ndarray):
+        with self._lock:
+            if self._index is None:
+                self._init_index(vec.size, 1024)
+            elif vec.size != self._dim:
+                raise ValueError(f"Embedding dimension {vec.size} does not match index ({self._dim})")
+            if user_id in self._deleted:
+                self._index.unmark_deleted(user_id)
+                self._deleted.discard(user_id)
+            self._reserve(1)
+            self._index.add_items(vec[None, :], np.asarray([user_id], dtype=np.int64))
+            self._live.add(user_id)
+
+    def remove(self, user_id: int):
+        with self._lock:
+            if self._index is None or user_id not in self._live:
+                return
+            self._index.mark_deleted(user_id)
+            self._live.discard(user_id)
+            self._deleted.add(user_id)
+
+    def search(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            if self._index is None or not self._live or queries.shape[1] != self._dim:
+                return np.full(len(queries), -1, dtype=np.int64), np.full(len(queries), -1.0)
+            labels, distances = self._index.knn_query(queries, k=1)
+        # "ip" distance is 1 - dot product
+        return labels[:, 0].astype(np.int64), 1.0 - distances[:, 0]
+
+    def save(self, path: str):
+        with self._lock:
+            if self._index is None:
+                return
+            self._index.save_index(f"{path}.hnsw")
+            with open(f"{path}.hnsw.json", "w") as f:
+                json.dump({"dim": self._dim, "live": sorted(self._live), "deleted": sorted(self._deleted)}, f)
+
+    def load(self, path: str) -> bool:
+        if not (os.path.exists(f"{path}.hnsw") and os.path.exists(f"{path}.hnsw.json")):
+            return False
+        with open(f"{path}.hnsw.json") as f:
+            state = json.load(f)
+        with self._lock:
+            self._index = hnswlib.Index(space="ip", dim=state["dim"])
+            self._index.load_index(f"{path}.hnsw", allow_replace_deleted=True)
+            self._index.set_ef(self.ef_search)
+            self._dim = state["dim"]
+            self._live, self._deleted = set(state["live"]), set(state["deleted"])
+        return True
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+
+BACKENDS = {
+    ExactBackend.name: ExactBackend,
+    HnswBackend.name: HnswBackend,
+}
+
+
+def create_backend(name: str = IDENTIFY_BACKEND):
+    """Instantiate a search backend by name, falling back to exact search"""
+    backend_cls = BACKENDS.get(name)
+    if backend_cls is None:
+        print(f"[GALLERY] Unknown IDENTIFY_BACKEND '{name}', using exact search")
+        backend_cls = ExactBackend
+    try:
+        return backend_cls()
+    except RuntimeError as e:
+        print(f"[GALLERY] {e}; using exact search")
+        return ExactBackend()
+
+
+class GalleryIndex:
+    """Enrolled embeddings plus per-user role and row version for incremental sync"""
+
+    def __init__(self, backend=None, index_path: Optional[str] = GALLERY_INDEX_PATH,
+                 refresh_seconds: int = GALLERY_REFRESH_SECONDS):
+        self.backend = backend if backend is not None else create_backend()
+        self.index_path = index_path
+        self.refresh_seconds = refresh_seconds
+        # Index files are written and read as a set by one process at a time
+        self._file_lock = FileLock(f"{index_path}.lock") if index_path else None
+        # Replaced by any worker whose gallery changed; others re-sync when it moves
+        self._stamp_path = f"{index_path}.version" if index_path else None
+        self._seen_stamp = None
+        # Serializes load/refresh/save and mutations; re-entrant because
+        # save() can run from refresh paths that already hold it
+        self._lock = threading.RLock()
+        self._roles: Dict[int, str] = {}
+        # users.updated_at as last seen; None means "re-read on next refresh"
+        self._versions: Dict[int, Optional[str]] = {}
+        self._loaded = False
+        self._needs_rebuild = False
+        self._refreshed_at = 0.0
+        self._dirty = False
+
+    # ------------------------------------------------------------------
+    # Database sync
+    # ------------------------------------------------------------------
+    def build(self, db: Session):
+        """Rebuild the whole gallery from the database"""
+        rows = db.query(
+            models.User.id, models.User.role, models.User.face_embedding_vector, models.User.updated_at
+        ).filter(models.User.face_embedding_vector.isnot(None)).all()
+
+        ids, vectors, roles, versions = [], [], {}, {}
+        for user_id, role, blob, updated_at in rows:
+            vec = unpack_embedding(blob)
+            if vec is None:
+                continue
+            ids.append(user_id)
+            vectors.append(vec)
+            roles[user_id] = role or ""
+            versions[user_id] = str(updated_at)
+
+        matrix = np.vstack(vectors).astype(np.float32) if vectors else np.empty((0, 0), dtype=np.float32)
+        self.backend.build(np.asarray(ids, dtype=np.int64), matrix)
+        self._roles, self._versions = roles, versions
+        self._loaded = True
+        self._needs_rebuild = False
+        self._refreshed_at = time.monotonic()
+        self._dirty = True
+
+    def refresh(self, db: Session):
+        """
+        Sync with the database by comparing row versions, so only users that
+        were added, changed or removed since the last sync are read.
+        """
+        current = {
+            user_id: str(updated_at)
+            for user_id, updated_at in db.query(models.User.id, models.User.updated_at).filter(
+                models.User.face_embedding_vector.isnot(None)
+            )
+        }
+        removed = [uid for uid in self._versions if uid not in current]
+        changed = [uid for uid, version in current.items() if self._versions.get(uid) != version]
+
+        for user_id in removed:
+            self._remove(user_id)
+
+        # Chunked to stay under SQLite's bound-parameter limit
+        for start in range(0, len(changed), 500):
+            rows = db.query(
+                models.User.id, models.User.role, models.User.face_embedding_vector, models.User.updated_at
+            ).filter(models.User.id.in_(changed[start:start + 500])).all()
+            for user_id, role, blob, updated_at in rows:
+                vec = unpack_embedding(blob)
+                if vec is not None:
+                    self._upsert(user_id, role, vec)
+                else:
+                    self._remove(user_id)
+                self._versions[user_id] = str(updated_at)
+
+        self._refreshed_at = time.monotonic()
+        if removed or changed:
+            self._dirty = True
+
+    def _load_locked(self, db: Session):
+        self._seen_stamp = self._read_stamp()  # Before reading, so later bumps aren't missed
+        if self._needs_rebuild or not self._load_from_disk():
+            print(f"[GALLERY] Building {self.backend.name} index from database...")
+            self.build(db)
+        else:
+            self.refresh(db)
+        print(f"[GALLERY] {len(self)} embeddings loaded ({self.backend.name})")
+        self._save_if_dirty()
+
+    def load(self, db: Session):
+        """Load the persisted index from disk and sync it, or build from scratch"""
+        with self._lock:
+            self._load_locked(db)
+
+    def ensure_loaded(self, db: Session):
+        """Load on first use; re-sync when the refresh interval elapsed"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load_locked(db)
+            return
+        stamp = self._read_stamp()
+        expired = self.refresh_seconds > 0 and time.monotonic() - self._refreshed_at > self.refresh_seconds
+        if expired or stamp != self._seen_stamp:
+            # Another request is already syncing - keep serving the current data
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.refresh(db)
+                    self._seen_stamp = stamp
+                    self._save_if_dirty()
+                finally:
+                    self._lock.release()
+
+    def invalidate(self):
+        """Force a re-sync with the database on the next search"""
+        self._refreshed_at = 0.0
+
+    # ------------------------------------------------------------------
+    # Cross-worker version stamp
+    # ------------------------------------------------------------------
+    def _read_stamp(self):
+        if not self._stamp_path:
+            return None
+        try:
+            st = os.stat(self._stamp_path)
+        except OSError:
+            return None
+        # A replace always brings a new inode, even where mtime is coarse
+        return st.st_ino, st.st_mtime_ns
+
+    def _bump_stamp(self):
+        """Tell other workers the gallery changed (after the DB commit)"""
+        if not self._stamp_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._stamp_path) or ".", exist_ok=True)
+            tmp_path = f"{self._stamp_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(time.time_ns()))
+            os.replace(tmp_path, self._stamp_path)
+        except OSError as e:
+            print(f"[GALLERY] Failed to bump version stamp: {e}")
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def _load_from_disk(self) -> bool:
+        if not self.index_path or not os.path.exists(f"{self.index_path}.meta.json"):
+            return False
+        try:
+            with self._file_lock:
+                with open(f"{self.index_path}.meta.json") as f:
+                    meta = json.load(f)
+                if meta.get("backend") != self.backend.name or not self.backend.load(self.index_path):
+                    return False
+        except Exception as e:
+            print(f"[GALLERY] Could not load index from {self.index_path}: {e}")
+            return False
+        self._roles = {int(k): v for k, v in meta["roles"].items()}
+        self._versions = {int(k): v for k, v in meta["versions"].items()}
+        self._loaded = True
+        return True
+
+    def save(self):
+        """Persist the index and its metadata to GALLERY_INDEX_PATH"""
+        if not self.index_path or not self._loaded:
+            return
+        try:
+            with self._lock, self._file_lock:
+                self.backend.save(self.index_path)
+                meta = {
+                    "backend": self.backend.name,
+                    "roles": {str(k): v for k, v in self._roles.items()},
+                    "versions": {str(k): v for k, v in self._versions.items()},
+                }
+                tmp_path = f"{self.index_path}.meta.json.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(meta, f)
+                os.replace(tmp_path, f"{self.index_path}.meta.json")
+            self._dirty = False
+        except Exception as e:
+            print(f"[GALLERY] Failed to save index: {e}")
+
+    def _save_if_dirty(self):
+        if self._dirty:
+            self.save()
+
+    # ------------------------------------------------------------------
+    # Mutations and search
+    # ------------------------------------------------------------------
+    def _upsert(self, user_id: int, role: str, embedding):
+        vec = normalize(np.asarray(embedding, dtype=np.float32).ravel())
+        try:
+            self.backend.upsert(user_id, vec)
+        except ValueError as e:
+            # Embedding model changed; the next search rebuilds everything
+            print(f"[GALLERY] {e}; rebuilding")
+            self._needs_rebuild = True
+            self._loaded = False
+            return
+        self._roles[user_id] = role or ""
+
+    def upsert(self, user_id: int, role: str, embedding) -> None:
+        """Add or replace one user's (committed) embedding, here and in the other workers"""
+        with self._lock:
+            if self._loaded:  # Otherwise the first load reads it from the DB
+                self._upsert(user_id, role, embedding)
+                self._versions[user_id] = None  # Pick up the committed updated_at later
+                self._dirty = True
+        self._bump_stamp()
+
+    def _remove(self, user_id: int):
+        self.backend.remove(user_id)
+        self._roles.pop(user_id, None)
+        self._versions.pop(user_id, None)
+        self._dirty = True
+
+    def remove(self, user_id: int) -> None:
+        """Remove a user from the gallery (e.g. face data was reset), here and in the other workers"""
+        with self._lock:
+            self._remove(user_id)
+        self._bump_stamp()
+
+    def search(self, db: Session, embedding) -> Tuple[Optional[int], Optional[str], float]:
+        """
+        Find the closest enrolled user.
+        Returns (user_id, role, score); user_id is None if the gallery is empty.
+        """
+        self.ensure_loaded(db)
+        query = normalize(np.asarray(embedding, dtype=np.float32).ravel())
+        ids, scores = self.backend.search(query[None, :])
+        user_id = int(ids[0])
+        if user_id < 0:
+            return None, None, -1.0
+        return user_id, self._roles.get(user_id), float(scores[0])
+
+    def search_batch(self, db: Session, embeddings) -> List[Tuple[Optional[int], Optional[str], float]]:
+        """
+        Find the closest enrolled user for each row of embeddings with a single
+        matrix-matrix product. Returns one (user_id, role, score) per query.
+        """
+        self.ensure_loaded(db)
+        queries = np.asarray(embeddings, dtype=np.float32)
+        if queries.ndim != 2 or not len(queries):
+            return []
+        queries = _normalize_rows(queries)
+        ids, scores = self.backend.search(queries)
+        results = []
+        for user_id, score in zip(ids.tolist(), scores.tolist()):
+            if user_id < 0:
+                results.append((None, None, -1.0))
+            else:
+                results.append((user_id, self._roles.get(user_id), float(score)))
+        return results
+
+    def __len__(self) -> int:
+        return len(self.backend)
+
+
+# Global gallery index instance
+gallery_index = GalleryIndex()
@@ -0,0 +1,214 @@
+"""
+Heartbeat Tracker - Coalesced kiosk heartbeats
+Heartbeats update an in-memory last-seen table against a cached gate list;
+a background thread writes them to gates.last_heartbeat_at in one bulk
+UPDATE per interval. A gate changing status (not yet integrated, marked
+offline, or silent long enough to show offline) is written immediately.
+"""
+import os
+import time
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+from sqlalchemy import update
+
+import database
+import models
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+# Seconds between bulk writes of coalesced heartbeats
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "30"))
+# Seconds before the cached door_id -> gate mapping is reloaded
+HEARTBEAT_GATE_CACHE_TTL = float(os.getenv("HEARTBEAT_GATE_CACHE_TTL", "60"))
+# Silence after which the dashboard shows a gate offline (Gate::isOnline, 5 min)
+HEARTBEAT_OFFLINE_SECONDS = float(os.getenv("HEARTBEAT_OFFLINE_SECONDS", "300"))
+# Timezone of last_heartbeat_at, to match the Laravel app
+HEARTBEAT_TIMEZONE = ZoneInfo(os.getenv("HEARTBEAT_TIMEZONE", "Asia/Jakarta"))
+
+
+@dataclass
+class GateEntry:
+    id: int
+    name: str
+    integrated: bool
+    persisted_at: Optional[float]  # Epoch of the heartbeat last written to the database
+
+
+class HeartbeatTracker:
+    """door_id -> gate cache plus pending last-seen times, flushed by one thread"""
+
+    def __init__(
+        self,
+        flush_interval: float = HEARTBEAT_FLUSH_INTERVAL,
+        cache_ttl: float = HEARTBEAT_GATE_CACHE_TTL,
+    ):
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # Single-flight cache reloads
+        self._gates: Dict[str, GateEntry] = {}
+        self._built_at: Optional[float] = None
+        self._pending: Dict[int, datetime] = {}  # Gate id -> latest unwritten heartbeat
+        self._stop = threading.Event()
+        self._thread = None
+        self.received = 0
+        self.immediate_writes = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        """Start the background flusher"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="heartbeat-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write everything still pending"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    # ------------------------------------------------------------------
+    # Gate cache
+    # ------------------------------------------------------------------
+
+    def _refresh(self):
+        db = database.SessionLocal()
+        try:
+            rows = db.query(
+                models.Gate.id, models.Gate.door_id, models.Gate.name,
+                models.Gate.integration_status, models.Gate.last_heartbeat_at
+            ).filter(models.Gate.door_id.isnot(None)).all()
+        finally:
+            db.close()
+
+        with self._lock:
+            gates = {}
+            for gate_id, door_id, name, status, last_heartbeat_at in rows:
+                persisted_at = None
+                if last_heartbeat_at is not None:
+                    if last_heartbeat_at.tzinfo is None:
+                        last_heartbeat_at = last_heartbeat_at.replace(tzinfo=HEARTBEAT_TIMEZONE)
+                    persisted_at = last_heartbeat_at.timestamp()
+                previous = self._gates.get(door_id)
+                if previous and previous.id == gate_id and previous.persisted_at:
+                    # A write of ours may be newer than the row we just read
+                    persisted_at = max(persisted_at or 0.0, previous.persisted_at)
+                gates[door_id] = GateEntry(gate_id, name, status == "integrated", persisted_at)
+            self._gates = gates
+            self._built_at = time.monotonic()
+
+    def _is_stale(self) -> bool:
+        return self._built_at is None or time.monotonic() - self._built_at > self.cache_ttl
+
+    def _lookup(self, device_id: str) -> Optional[GateEntry]:
+        if self._is_stale():
+            with self._refresh_lock:
+                if self._is_stale():
+                    try:
+                        self._refresh()
+                    except Exception as e:
+                        if self._built_at is None:
+                            raise
+                        print(f"[HEARTBEAT] Gate cache refresh failed, using cached gates: {e}")
+        return self._gates.get(device_id)
+
+    def invalidate(self):
+        """Reload gates on the next heartbeat (e.g. after a gate was changed)"""
+        self._built_at = None
+
+    # ------------------------------------------------------------------
+    # Heartbeats
+    # ------------------------------------------------------------------
+
+    def record(self, device_id: str) -> dict:
+        """
+        Record a heartbeat from a client device. Only status transitions touch
+        the database here; plain heartbeats wait for the next bulk flush.
+        """
+        gate = self._lookup(device_id)
+        if not gate:
+            return {"success": False, "error": f"Gate not found for device_id: {device_id}"}
+
+        now = datetime.now(HEARTBEAT_TIMEZONE)
+        with self._lock:
+            self.received += 1
+            went_quiet = gate.persisted_at is None or now.timestamp() - gate.persisted_at >= HEARTBEAT_OFFLINE_SECONDS
+            if gate.integrated and not went_quiet:
+                self._pending[gate.id] = now
+                return {"success": True, "gate_id": gate.id, "gate_name": gate.name}
+            self._pending.pop(gate.id, None)
+            self.immediate_writes += 1
+
+        if not self._write([{"id": gate.id, "last_heartbeat_at": now, "integration_status": "integrated"}]):
+            with self._lock:
+                self._pending.setdefault(gate.id, now)  # Retried by the next flush
+        return {"success": True, "gate_id": gate.id, "gate_name": gate.name}
+
+    def flush(self):
+        """Write every pending heartbeat in one bulk UPDATE"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows = [
+            {"id": gate_id, "last_heartbeat_at": seen_at, "integration_status": "integrated"}
+            for gate_id, seen_at in pending.items()
+        ]
+        if self._write(rows):
+            with self._lock:
+                self.flushed += len(rows)
+        else:
+            with self._lock:
+                self.failed_flushes += 1
+                for gate_id, seen_at in pending.items():
+                    # Keep anything newer that arrived while we were writing
+                    self._pending.setdefault(gate_id, seen_at)
+
+    def _write(self, rows: List[dict]) -> bool:
+        db = database.SessionLocal()
+        try:
+            db.execute(update(models.Gate), rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[HEARTBEAT] Failed to write {len(rows)} gate heartbeats: {e}")
+            return False
+        finally:
+            db.close()
+
+        with self._lock:
+            written = {row["id"]: row["last_heartbeat_at"].timestamp() for row in rows}
+            for gate in self._gates.values():
+                if gate.id in written:
+                    gate.integrated = True
+                    gate.persisted_at = max(gate.persisted_at or 0.0, written[gate.id])
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "cached_gates": len(self._gates),
+                "pending": len(self._pending),
+                "received": self.received,
+                "immediate_writes": self.immediate_writes,
+                "flushed": self.flushed,
+                "failed_flushes": self.failed_flushes,
+            }
+
+
+# Global heartbeat tracker instance
+heartbeat_tracker = HeartbeatTracker()
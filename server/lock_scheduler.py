@@ -0,0 +1,245 @@
+"""
+Lock Scheduler - Durable auto-lock deadlines for door devices
+One timer task drives a heap of pending re-locks keyed by device. Unlocking
+a door that is already open extends its deadline instead of stacking another
+sleep, and deadlines are persisted so a restart still locks the door.
+The schedule file is shared by every uvicorn worker and only changed under a
+file lock; before locking a door, a worker checks that no other worker has
+pushed its deadline later.
+"""
+import os
+import json
+import time
+import heapq
+import asyncio
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import solenoid_client
+from file_lock import FileLock
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+# Where pending re-lock deadlines are persisted (empty disables persistence)
+LOCK_SCHEDULE_PATH = os.getenv(
+    "LOCK_SCHEDULE_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "lock_schedule.json"),
+)
+# Seconds before a failed re-lock is attempted again
+LOCK_RETRY_SECONDS = float(os.getenv("LOCK_RETRY_SECONDS", "30"))
+
+
+class LockScheduler:
+    """Pending re-lock per device, fired by a single timer task"""
+
+    def __init__(self, path: Optional[str] = LOCK_SCHEDULE_PATH):
+        self.path = path
+        self._file_lock = FileLock(f"{path}.lock") if path else None
+        self._deadlines: Dict[str, float] = {}  # Device URL -> epoch seconds
+        self._restored = set()  # Re-armed from disk; every worker re-arms these
+        self._heap: List[Tuple[float, str]] = []  # May hold superseded entries
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._firing = set()  # Keeps in-flight lock tasks referenced
+
+    async def start(self):
+        """Re-arm persisted deadlines (overdue doors lock right away) and start the timer"""
+        self._wakeup = asyncio.Event()
+        for url, deadline in (await asyncio.to_thread(self._read_shared)).items():
+            self._arm(url, deadline)
+            self._restored.add(url)
+        if self._deadlines:
+            print(f"[LOCK] Re-armed {len(self._deadlines)} pending re-lock(s)")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the timer; pending deadlines stay on disk for the next start"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._firing:
+            await asyncio.gather(*self._firing, return_exceptions=True)
+
+    def _key(self, gate_ip: Optional[str]) -> str:
+        return (gate_ip or solenoid_client.IOT_URL).rstrip("/")
+
+    def _arm(self, url: str, deadline: float):
+        # Re-unlocking an open door only ever pushes its re-lock later
+        deadline = max(deadline, self._deadlines.get(url, 0.0))
+        self._deadlines[url] = deadline
+        heapq.heappush(self._heap, (deadline, url))
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def unlock_and_auto_lock(self, gate_ip: str = None, duration_seconds: int = None) -> dict:
+        """
+        Unlock the door and wait until the scheduler has locked it again.
+        Awaiting a future is cheap; the only timer is the scheduler's own.
+        """
+        duration = duration_seconds or solenoid_client.DOOR_UNLOCK_DURATION
+        url = self._key(gate_ip)
+
+        # Arm before unlocking so a re-lock that is just firing sees the new
+        # deadline and skips, instead of locking the door we're opening
+        waiter = asyncio.get_running_loop().create_future()
+        was_pending = url in self._deadlines
+        self._waiters.setdefault(url, []).append(waiter)
+        self._arm(url, time.time() + duration)
+        await asyncio.to_thread(self._persist, url, self._deadlines[url])
+
+        unlock_result = await solenoid_client.unlock_door(url)
+        if not unlock_result.get("success"):
+            pending = self._waiters.get(url, [])
+            if waiter in pending:
+                pending.remove(waiter)
+            waiter.cancel()
+            # Door never opened: drop the re-lock we armed (one already pending for
+            # an earlier unlock stays, locking a locked door is harmless)
+            if not was_pending and not pending and url in self._deadlines:
+                await asyncio.to_thread(self._discard, url, self._deadlines.pop(url))
+            return unlock_result
+
+        print(f"[LOCK] Door {url} unlocked, re-lock in {self.pending().get(url, 0.0)}s")
+        lock_result = await waiter
+        return {
+            "unlock": unlock_result,
+            "lock": lock_result,
+            "duration": duration
+        }
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            # Drop entries superseded by a later deadline for the same door
+            while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            deadline, url = self._heap[0]
+            delay = deadline - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            del self._deadlines[url]
+            waiters = self._waiters.pop(url, [])
+            task = asyncio.create_task(self._fire(url, deadline, waiters))
+            self._firing.add(task)
+            task.add_done_callback(self._firing.discard)
+
+    async def _fire(self, url: str, deadline: float, waiters: List[asyncio.Future]):
+        if url in self._deadlines:
+            # Re-unlocked before the lock went out: keep the door open until the new deadline
+            self._waiters[url] = waiters + self._waiters.get(url, [])
+            return
+
+        restored = url in self._restored
+        self._restored.discard(url)
+        claimed = await asyncio.to_thread(self._claim, url, deadline)
+        if url in self._deadlines:
+            # Re-unlocked here while we were reading the schedule
+            self._waiters[url] = waiters + self._waiters.get(url, [])
+            return
+        if claimed is None and restored and not waiters:
+            return  # Re-armed from disk by every worker; another one already locked it
+        if claimed is not None and claimed > deadline:
+            # Re-unlocked by another worker: keep the door open until its deadline
+            self._waiters[url] = waiters + self._waiters.get(url, [])
+            self._arm(url, claimed)
+            return
+
+        result = await solenoid_client.lock_door(url)
+        if not result.get("success") and url not in self._deadlines:
+            print(f"[LOCK] Re-lock of {url} failed, retrying in {LOCK_RETRY_SECONDS:.0f}s")
+            self._arm(url, time.time() + LOCK_RETRY_SECONDS)
+            await asyncio.to_thread(self._persist, url, self._deadlines[url])
+
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(result)
+
+    def pending(self) -> Dict[str, float]:
+        """Seconds until each pending re-lock"""
+        now = time.time()
+        return {url: round(max(0.0, deadline - now), 1) for url, deadline in self._deadlines.items()}
+
+    # ------------------------------------------------------------------
+    # Shared schedule file (blocking: called through asyncio.to_thread so
+    # contention on the file lock never stalls the event loop)
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def _schedule(self):
+        """Persisted deadlines of all workers, written back on exit under the file lock"""
+        if not self.path:
+            yield {}
+            return
+        with self._file_lock:
+            deadlines = self._load()
+            yield deadlines
+            self._save(deadlines)
+
+    def _read_shared(self) -> Dict[str, float]:
+        with self._schedule() as deadlines:
+            return dict(deadlines)
+
+    def _persist(self, url: str, deadline: float):
+        with self._schedule() as deadlines:
+            deadlines[url] = max(deadline, deadlines.get(url, 0.0))
+
+    def _discard(self, url: str, deadline: float):
+        """Forget a deadline we armed, unless another worker has since pushed it later"""
+        with self._schedule() as deadlines:
+            if deadlines.get(url, 0.0) <= deadline:
+                deadlines.pop(url, None)
+
+    def _claim(self, url: str, deadline: float) -> Optional[float]:
+        """
+        Take a due re-lock off the shared schedule. Returns the persisted
+        deadline: later than ours if another worker re-unlocked the door
+        (left in place), None if no worker has it pending any more.
+        """
+        if not self.path:
+            return deadline
+        with self._schedule() as deadlines:
+            persisted = deadlines.get(url)
+            if persisted is not None and persisted <= deadline:
+                del deadlines[url]
+            return persisted
+
+    def _load(self) -> Dict[str, float]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return {str(url): float(deadline) for url, deadline in json.load(f).items()}
+        except Exception as e:
+            print(f"[LOCK] Ignoring unreadable lock schedule: {e}")
+            return {}
+
+    def _save(self, deadlines: Dict[str, float]):
+        try:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(deadlines, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[LOCK] Failed to persist lock schedule: {e}")
+
+
+# Global lock scheduler instance
+lock_scheduler = LockScheduler()
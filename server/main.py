@@ -3,17 +3,67 @@ import os
 os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
 os.environ.setdefault("OMP_NUM_THREADS", "1")
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-import database, schemas, crud
+import database, schemas, crud, executor, solenoid_client
+from gallery_index import gallery_index
+from access_index import access_index
+from audit_writer import audit_writer
+from door_registry import door_registry
+from lock_scheduler import lock_scheduler
+from event_forwarder import event_forwarder
+from session_manager import session_manager
+from session_events import session_events
+from heartbeat_tracker import heartbeat_tracker
 
 # Create database tables (not strictly necessary as we use existing DB, but safe for dev)
 # models.Base.metadata.create_all(bind=database.engine)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    audit_writer.start()
+    heartbeat_tracker.start()
+    await event_forwarder.start()  # Also delivers events spooled before a restart
+
+    # Load the face gallery before serving so the first scan doesn't pay for it
+    db = database.SessionLocal()
+    try:
+        backfilled = crud.backfill_embedding_vectors(db)
+        if backfilled:
+            print(f"[GALLERY] Packed {backfilled} legacy JSON embeddings into face_embedding_vector")
+        gallery_index.load(db)
+    except Exception as e:
+        print(f"[GALLERY] Startup load failed, will retry on first scan: {e}")
+    try:
+        access_index.refresh(db)
+        door_registry.refresh(db)
+    except Exception as e:
+        print(f"[ACCESS INDEX] Startup load failed, will retry on first scan: {e}")
+    finally:
+        db.close()
+    access_refresh = asyncio.create_task(access_index.refresh_loop())
+    session_reaper = asyncio.create_task(session_manager.reap_loop())
+    await lock_scheduler.start()  # Re-arms re-locks left pending by a restart
+
+    yield
+
+    access_refresh.cancel()
+    session_reaper.cancel()
+    await lock_scheduler.stop()
+    executor.shutdown()
+    audit_writer.stop()  # Flush queued audit rows before exit
+    heartbeat_tracker.stop()  # Write the last coalesced heartbeats
+    await solenoid_client.device_pool.aclose()
+    await event_forwarder.stop()
+    gallery_index.save()
+
 app = FastAPI(
     title="Sentinel Access Control API",
     description="Python FastAPI backend for IoT Access Control integration",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 from routers import faces, session
@@ -24,6 +74,20 @@ app.include_router(session.router)
 def read_root():
     return {"message": "Sentinel Access Control API is running"}
 
+@app.get("/api/metrics")
+def metrics():
+    """Runtime metrics for capacity planning"""
+    return {
+        "db_pool": database.pool_metrics(),
+        "audit_writer": audit_writer.metrics(),
+        "iot_devices": solenoid_client.device_pool.metrics(),
+        "pending_relocks": lock_scheduler.pending(),
+        "access_events": event_forwarder.metrics(),
+        "sessions": session_manager.metrics(),
+        "session_events": session_events.metrics(),
+        "heartbeats": heartbeat_tracker.metrics(),
+    }
+
 @app.post("/api/access/validate", response_model=schemas.AccessValidateResponse)
 def validate_access(request: schemas.AccessValidateRequest, http_request: Request, db: Session = Depends(database.get_db)):
     """
@@ -47,11 +111,12 @@ def validate_access(request: schemas.AccessValidateRequest, http_request: Reques
     )
 
 @app.post("/api/heartbeat")
-def heartbeat(request: schemas.HeartbeatRequest, db: Session = Depends(database.get_db)):
+def heartbeat(request: schemas.HeartbeatRequest):
     """
-    Receive heartbeat from client device and update gate status directly.
+    Receive heartbeat from client device. Last-seen times are coalesced and
+    written in bulk; a gate coming (back) online is written immediately.
     """
-    result = crud.update_gate_heartbeat(db, request.device_id)
+    result = heartbeat_tracker.record(request.device_id)
     
     if not result.get("success"):
         raise HTTPException(status_code=404, detail=result.get("error"))
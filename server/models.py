@@ -1,18 +1,22 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON, Table
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON, Table, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
+from embedding_utils import pack_embedding, unpack_embedding
+import numpy as np
 
 # Association Table for Gate-Task Many-to-Many
 gate_task = Table('gate_task', Base.metadata,
     Column('gate_id', Integer, ForeignKey('gates.id')),
-    Column('task_id', Integer, ForeignKey('tasks.id'))
+    Column('task_id', Integer, ForeignKey('tasks.id')),
+    Index('gate_task_task_id_gate_id_index', 'task_id', 'gate_id')
 )
 
 # Association Table for Task-Vendor Many-to-Many
 task_vendor = Table('task_vendor', Base.metadata,
     Column('task_id', Integer, ForeignKey('tasks.id')),
-    Column('vendor_id', Integer, ForeignKey('users.id'))
+    Column('vendor_id', Integer, ForeignKey('users.id')),
+    Index('task_vendor_vendor_id_task_id_index', 'vendor_id', 'task_id')
 )
 
 class User(Base):
@@ -23,10 +27,27 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     role = Column(String) # vendor, dcfm, soc
     face_image = Column(Text, nullable=True)
-    face_embedding = Column(JSON, nullable=True) # Store embedding as JSON list
+    face_embedding = Column(JSON(none_as_null=True), nullable=True) # Legacy JSON list; only read until packed into the vector
+    face_embedding_vector = Column(LargeBinary, nullable=True) # Packed float32/float16 embedding
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    def get_face_embedding(self):
+        """Stored embedding as a NumPy array (zero-copy from the binary column)"""
+        if self.face_embedding_vector:
+            return unpack_embedding(self.face_embedding_vector)
+        if self.face_embedding:
+            return np.asarray(self.face_embedding, dtype=np.float32)
+        return None
+
+    def set_face_embedding(self, embedding):
+        """Store an embedding in the binary column (clearing any legacy JSON copy)"""
+        self.face_embedding = None
+        self.face_embedding_vector = pack_embedding(embedding) if embedding is not None else None
+
+    def has_face_embedding(self) -> bool:
+        return bool(self.face_embedding_vector or self.face_embedding)
+
     def is_vendor(self):
         return self.role == 'vendor'
 
@@ -51,6 +72,10 @@ class Gate(Base):
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index('tasks_pic_id_status_start_time_end_time_index', 'pic_id', 'status', 'start_time', 'end_time'),
+        Index('tasks_updated_at_index', 'updated_at'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String)  # Renamed from notes
@@ -58,6 +83,7 @@ class Task(Base):
     start_time = Column(DateTime)
     end_time = Column(DateTime)
     status = Column(String) # active, completed, revoked
+    updated_at = Column(DateTime, nullable=True)  # Set by Laravel; drives the access index deltas
 
     pic = relationship("User", foreign_keys=[pic_id])
     vendors = relationship("User", secondary=task_vendor)  # Many-to-many
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from sqlalchemy.orm import Session
 import schemas, crud, database, models
+from gallery_index import gallery_index
 import logging
 
 logger = logging.getLogger(__name__)
@@ -28,7 +29,7 @@ def enroll_face(user: schemas.UserCreate, db: Session = Depends(database.get_db)
         )
     
     # Check if user already has face data
-    if existing_user.face_image and existing_user.face_embedding:
+    if existing_user.face_image and existing_user.has_face_embedding():
         raise HTTPException(
             status_code=400, 
             detail=f"User '{user.name}' already has face data enrolled."
@@ -38,10 +39,12 @@ def enroll_face(user: schemas.UserCreate, db: Session = Depends(database.get_db)
     if user.face_image:
         existing_user.face_image = user.face_image
     if user.embedding:
-        existing_user.face_embedding = user.embedding
+        existing_user.set_face_embedding(user.embedding)
     
     db.commit()
     db.refresh(existing_user)
+    if user.embedding:
+        gallery_index.upsert(existing_user.id, existing_user.role, user.embedding)
     
     return {
         "status": "success",
@@ -51,12 +54,15 @@ def enroll_face(user: schemas.UserCreate, db: Session = Depends(database.get_db)
         "role": existing_user.role
     }
 
-@router.post("/identify")
-def identify_face(request: schemas.IdentifyRequest, db: Session = Depends(database.get_db)):
+@router.post("/identify", openapi_extra=schemas.binary_body_openapi(schemas.IdentifyRequest))
+def identify_face(
+    request: schemas.IdentifyRequest = Depends(schemas.binary_body(schemas.IdentifyRequest)),
+    db: Session = Depends(database.get_db)
+):
     """
     Identify a user from an embedding (1:N search).
     """
-    user, score = crud.identify_user(db, request.embedding)
+    user, score = crud.identify_user(db, request.vector())
     if user:
         return {
             "match": True,
@@ -71,6 +77,35 @@ def identify_face(request: schemas.IdentifyRequest, db: Session = Depends(databa
     }
 
 
+@router.post("/identify-batch", openapi_extra=schemas.binary_body_openapi(schemas.IdentifyBatchRequest))
+def identify_faces_batch(
+    request: schemas.IdentifyBatchRequest = Depends(schemas.binary_body(schemas.IdentifyBatchRequest)),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Identify every face of a frame in one request (1:N search per face).
+    Results are returned in the same order as the embeddings.
+    """
+    results = []
+    for index, (user, score) in enumerate(crud.identify_users(db, request.vectors())):
+        if user:
+            results.append({
+                "index": index,
+                "match": True,
+                "user_id": user.id,
+                "name": user.name,
+                "role": user.role,
+                "score": float(score)
+            })
+        else:
+            results.append({
+                "index": index,
+                "match": False,
+                "score": float(score)
+            })
+    return {"results": results}
+
+
 def process_embedding_task(user_id: int, user_name: str, face_image: str):
     """
     Background task to generate embedding from face_image and update user.
@@ -90,8 +125,9 @@ def process_embedding_task(user_id: int, user_name: str, face_image: str):
         # Update user with the generated embedding
         user = db.query(models.User).filter(models.User.id == user_id).first()
         if user:
-            user.face_embedding = embedding.tolist()
+            user.set_face_embedding(embedding)
             db.commit()
+            gallery_index.upsert(user.id, user.role, embedding)
             logger.info(f"Successfully generated and saved embedding for user {user_id} ({user_name})")
         else:
             logger.error(f"User {user_id} not found when trying to save embedding")
@@ -143,8 +179,9 @@ def enroll_from_image(
         embedding = crud.get_embedding_from_b64(user.face_image)
         
         if embedding is not None:
-            existing_user.face_embedding = embedding.tolist()
+            existing_user.set_face_embedding(embedding)
             db.commit()
+            gallery_index.upsert(existing_user.id, existing_user.role, embedding)
             logger.info(f"Successfully saved embedding for user {existing_user.id}")
             return {
                 "status": "success",
@@ -192,7 +229,7 @@ def get_enrollment_status(user_id: int, db: Session = Depends(database.get_db)):
         raise HTTPException(status_code=404, detail="User not found")
     
     has_image = bool(user.face_image)
-    has_embedding = bool(user.face_embedding)
+    has_embedding = user.has_face_embedding()
     
     if has_embedding:
         status = "complete"
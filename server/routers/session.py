@@ -2,26 +2,28 @@
 Session Router - Endpoints for access session management
 """
 import asyncio
-import os
-import httpx
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import json
+import struct
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
-from dotenv import load_dotenv
 
 import database
 import crud
+import schemas
 import models
-from session_manager import session_manager, SessionState, ScannedPerson
-import solenoid_client
-
-load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
-
-# Laravel API URL for logging access events
-LARAVEL_API_URL = os.getenv("LARAVEL_API_URL", "http://127.0.0.1:8000")
+from session_manager import session_manager, SessionState, ScannedPerson, FINISHED_STATES
+from session_events import session_events, SESSION_EVENTS_POLL
+from executor import run_blocking
+from embedding_utils import EMBEDDING_DIM
+from access_index import access_index
+from door_registry import door_registry
+from lock_scheduler import lock_scheduler
+from event_forwarder import event_forwarder
 
 router = APIRouter(
     prefix="/api/session",
@@ -33,9 +35,8 @@ class StartSessionRequest(BaseModel):
     gate_id: Optional[str] = None  # This is the door_id from client DEVICE_ID
 
 
-class ScanRequest(BaseModel):
+class ScanRequest(schemas.EmbeddingRequest):
     session_id: str
-    embedding: List[float]
 
 
 class SessionResponse(BaseModel):
@@ -47,6 +48,14 @@ class SessionResponse(BaseModel):
     task_id: Optional[int] = None
 
 
+class ScanBatchRequest(schemas.EmbeddingBatchRequest):
+    session_id: str  # One embedding per face in the frame
+
+
+class BatchScanResponse(SessionResponse):
+    matches: list = []  # Per-face identification results, in request order
+
+
 async def log_access_to_laravel(
     door_id: str,
     event_type: str,
@@ -57,117 +66,17 @@ async def log_access_to_laravel(
     reason: str = None,
     details: dict = None
 ):
-    """Log access event to Laravel API"""
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.post(
-                f"{LARAVEL_API_URL}/api/doors/log-access",
-                json={
-                    "door_id": door_id,
-                    "event_type": event_type,
-                    "vendor_id": vendor_id,
-                    "pic_id": pic_id,
-                    "task_id": task_id,
-                    "session_id": session_id,
-                    "reason": reason,
-                    "details": details,
-                }
-            )
-            print(f"[LARAVEL] Logged access: {response.status_code}")
-            return response.json()
-    except Exception as e:
-        print(f"[LARAVEL] Failed to log access: {e}")
-        return None
-
-
-def validate_task_for_access(
-    db: Session,
-    vendor_id: int,
-    pic_id: int,
-    door_id: str
-) -> tuple[bool, Optional[models.Task], str]:
-    """
-    Validate if there's an active task that allows the vendor-PIC pair
-    to access the gate at the current time.
-    
-    Returns: (is_valid, task, reason)
-    """
-    now = datetime.now()
-    
-    # Find the gate by door_id
-    gate = db.query(models.Gate).filter(models.Gate.gate_id == door_id).first()
-    if not gate:
-        # Try matching by the new door_id field (if existing gate_id doesn't match)
-        # For backwards compatibility, we check both
-        return False, None, f"Gate not found for door_id: {door_id}"
-    
-    # Find active task for this vendor-PIC pair using many-to-many relationship
-    task = db.query(models.Task).join(
-        models.task_vendor,
-        models.Task.id == models.task_vendor.c.task_id
-    ).filter(
-        and_(
-            models.task_vendor.c.vendor_id == vendor_id,
-            models.Task.pic_id == pic_id,
-            models.Task.status == 'active',
-            models.Task.start_time <= now,
-            models.Task.end_time >= now
-        )
-    ).first()
-    
-    if not task:
-        return False, None, "No active task found for this vendor-PIC pair at current time"
-    
-    # Check if gate is allowed in task
-    task_gate_ids = [g.gate_id for g in task.gates]
-    if gate.gate_id not in task_gate_ids:
-        return False, task, f"Gate '{gate.name}' is not authorized for this task"
-    
-    return True, task, "OK"
-
-
-def validate_task_for_access_by_pair(
-    db: Session,
-    vendor_id: int,
-    pic_id: int,
-    door_id: Optional[str] = None
-) -> tuple[bool, Optional[models.Task], str]:
-    """
-    Validate if there's an active task that allows the vendor-PIC pair
-    at the current time. Gate validation is optional (if door_id provided).
-    
-    This ensures that a valid task MUST exist for access to be granted.
-    
-    Returns: (is_valid, task, reason)
-    """
-    now = datetime.now()
-    
-    # Find active task for this vendor-PIC pair within time window using many-to-many
-    task = db.query(models.Task).join(
-        models.task_vendor,
-        models.Task.id == models.task_vendor.c.task_id
-    ).filter(
-        and_(
-            models.task_vendor.c.vendor_id == vendor_id,
-            models.Task.pic_id == pic_id,
-            models.Task.status == 'active',
-            models.Task.start_time <= now,
-            models.Task.end_time >= now
-        )
-    ).first()
-    
-    if not task:
-        return False, None, "No active task found for this vendor-PIC pair at current time"
-    
-    # If door_id provided, also validate gate authorization
-    if door_id:
-        gate = db.query(models.Gate).filter(models.Gate.gate_id == door_id).first()
-        if gate:
-            task_gate_ids = [g.gate_id for g in task.gates]
-            if gate.gate_id not in task_gate_ids:
-                return False, task, f"Gate '{gate.name}' is not authorized for this task"
-    
-    return True, task, "OK"
+    """Queue an access event for Laravel (spooled and delivered in batches)"""
+    event_forwarder.submit({
+        "door_id": door_id,
+        "event_type": event_type,
+        "vendor_id": vendor_id,
+        "pic_id": pic_id,
+        "task_id": task_id,
+        "session_id": session_id,
+        "reason": reason,
+        "details": details,
+    })
 
 
 @router.post("/start", response_model=SessionResponse)
@@ -185,18 +94,9 @@ def start_session(request: StartSessionRequest = None):
     )
 
 
-@router.post("/scan", response_model=SessionResponse)
-async def scan_face(
-    request: ScanRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(database.get_db)
-):
-    """
-    Process a face scan within a session.
-    - If vendor detected: add to queue
-    - If PIC detected: validate task, approve session and unlock door
-    """
-    session = session_manager.get_session(request.session_id)
+def _get_scannable_session(session_id: str):
+    """Return the session if it can still accept scans, else raise"""
+    session = session_manager.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found or expired")
     
@@ -205,19 +105,43 @@ async def scan_face(
     
     if session.state == SessionState.EXPIRED:
         raise HTTPException(status_code=400, detail="Session expired")
+    return session
+
+
+def _not_recognized_response(session, score: float, response_cls=SessionResponse):
+    return response_cls(
+        session_id=session.id,
+        state=session.state,
+        message=f"Face not recognized (score: {score:.2f}). Please try again.",
+        vendors=[v.name for v in session.vendors],
+        pic=None,
+    )
 
-    # Identify the person
-    user, score = crud.identify_user(db, request.embedding, threshold=0.45)
-    
-    if not user:
-        return SessionResponse(
-            session_id=session.id,
-            state=session.state,
-            message=f"Face not recognized (score: {score:.2f}). Please try again.",
-            vendors=[v.name for v in session.vendors],
-            pic=None,
-        )
 
+def _closed_session_response(session, response_cls=SessionResponse):
+    """Response for a scan that lost the race against another transition"""
+    current = session_manager.get_session(session.id) or session
+    return response_cls(
+        session_id=current.id,
+        state=current.state,
+        message="Session is no longer accepting scans.",
+        vendors=[v.name for v in current.vendors],
+        pic={"name": current.pic.name, "user_id": current.pic.user_id} if current.pic else None,
+    )
+
+
+def _handle_scanned_user(
+    session,
+    user: models.User,
+    background_tasks: BackgroundTasks,
+    db: Session,
+    response_cls=SessionResponse
+):
+    """
+    Apply an identified user to the session.
+    - If vendor detected: add to queue
+    - If PIC detected: validate task, approve session and unlock door
+    """
     person = ScannedPerson(
         user_id=user.id,
         name=user.name,
@@ -231,7 +155,7 @@ async def scan_face(
         
         if already_scanned:
             # Vendor already scanned - remind to scan PIC
-            return SessionResponse(
+            return response_cls(
                 session_id=session.id,
                 state=SessionState.WAITING_PIC,
                 message=f"Vendor '{user.name}' already scanned. Now scan PIC to approve.",
@@ -239,19 +163,21 @@ async def scan_face(
                 pic=None,
             )
         
-        session_manager.add_vendor(request.session_id, person)
-        return SessionResponse(
-            session_id=session.id,
+        updated = session_manager.add_vendor(session.id, person)
+        if not updated:
+            return _closed_session_response(session, response_cls)
+        return response_cls(
+            session_id=updated.id,
             state=SessionState.WAITING_PIC,  # After vendor, we're waiting for PIC
             message=f"Vendor '{user.name}' registered. Now scan PIC to approve (or add more vendors).",
-            vendors=[v.name for v in session.vendors],
+            vendors=[v.name for v in updated.vendors],
             pic=None,
         )
 
     elif user.role in ["dcfm", "soc"]:
         # PIC/Admin detected - validate task before unlock
         if len(session.vendors) == 0:
-            return SessionResponse(
+            return response_cls(
                 session_id=session.id,
                 state=session.state,
                 message="No vendors scanned yet. Vendors must scan first.",
@@ -266,8 +192,10 @@ async def scan_face(
         deny_reason = None
         
         # Check if there's a valid task for any vendor with this PIC
+        # (answered from the in-memory authorization index, synced once per scan)
+        access_index.sync(db)
         for vendor in session.vendors:
-            is_valid, task, reason = validate_task_for_access_by_pair(
+            is_valid, task, reason = access_index.validate_pair(
                 db, vendor.user_id, user.id, door_id
             )
             if is_valid:
@@ -295,7 +223,7 @@ async def scan_face(
                     details={"vendors": [v.name for v in session.vendors], "pic_attempted": user.name}
                 )
             
-            return SessionResponse(
+            return response_cls(
                 session_id=session.id,
                 state=SessionState.WAITING_PIC,  # Stay in waiting_pic state so correct PIC can scan
                 message=f"No task found. {error_msg}",
@@ -303,7 +231,12 @@ async def scan_face(
                 pic=None,
             )
 
-        session_manager.set_pic(request.session_id, person)
+        # Approval is atomic: if another scan approved or closed the session
+        # first, don't trigger a second unlock
+        approved = session_manager.set_pic(session.id, person)
+        if not approved:
+            return _closed_session_response(session, response_cls)
+        session = approved
         
         # Store task_id in session for logging
         task_id = validated_task.id if validated_task else None
@@ -311,14 +244,14 @@ async def scan_face(
         # Trigger door unlock in background
         background_tasks.add_task(
             unlock_door_flow, 
-            session_id=request.session_id,
+            session_id=session.id,
             door_id=door_id,
             task_id=task_id,
             vendor_ids=[v.user_id for v in session.vendors],
             pic_id=user.id
         )
 
-        return SessionResponse(
+        return response_cls(
             session_id=session.id,
             state=SessionState.APPROVED,
             message=f"Access APPROVED by PIC '{user.name}'. Door unlocking...",
@@ -328,7 +261,7 @@ async def scan_face(
         )
 
     else:
-        return SessionResponse(
+        return response_cls(
             session_id=session.id,
             state=session.state,
             message=f"Unknown role '{user.role}'. Cannot process.",
@@ -337,6 +270,163 @@ async def scan_face(
         )
 
 
+@router.post("/scan", response_model=SessionResponse, openapi_extra=schemas.binary_body_openapi(ScanRequest))
+async def scan_face(
+    background_tasks: BackgroundTasks,
+    request: ScanRequest = Depends(schemas.binary_body(ScanRequest)),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Process a face scan within a session.
+    - If vendor detected: add to queue
+    - If PIC detected: validate task, approve session and unlock door
+    """
+    # Session lookup, identification and task validation can all block; keep them off the loop
+    return await run_blocking(_scan_sync, request.session_id, request.vector(), background_tasks, db)
+
+
+def _scan_sync(session_id: str, embedding, background_tasks: BackgroundTasks, db: Session):
+    """Blocking part of a single-face scan (runs on the scan worker pool)"""
+    session = _get_scannable_session(session_id)
+
+    # Identify the person
+    user, score = crud.identify_user(db, embedding, threshold=0.45)
+    
+    if not user:
+        return _not_recognized_response(session, score)
+
+    return _handle_scanned_user(session, user, background_tasks, db)
+
+
+@router.post("/scan-batch", response_model=BatchScanResponse, openapi_extra=schemas.binary_body_openapi(ScanBatchRequest))
+async def scan_faces_batch(
+    background_tasks: BackgroundTasks,
+    request: ScanBatchRequest = Depends(schemas.binary_body(ScanBatchRequest)),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Process every face of one frame within a session.
+    Vendors are registered first, then any PIC is evaluated, so a group at the
+    door is admitted in a single round trip.
+    """
+    return await run_blocking(_scan_batch_sync, request.session_id, request.vectors(), background_tasks, db)
+
+
+def _scan_batch_sync(session_id: str, embeddings, background_tasks: BackgroundTasks, db: Session):
+    """Blocking part of a multi-face scan (runs on the scan worker pool)"""
+    session = _get_scannable_session(session_id)
+    results = crud.identify_users(db, embeddings, threshold=0.45)
+    matches = []
+    recognized = {}
+    for index, (user, score) in enumerate(results):
+        if user:
+            matches.append({"index": index, "match": True, "user_id": user.id,
+                            "name": user.name, "role": user.role, "score": float(score)})
+            recognized.setdefault(user.id, user)
+        else:
+            matches.append({"index": index, "match": False, "score": float(score)})
+
+    if not recognized:
+        best_score = max((score for _, score in results), default=0.0)
+        response = _not_recognized_response(session, best_score, BatchScanResponse)
+        response.matches = matches
+        return response
+
+    users = list(recognized.values())
+    ordered = [u for u in users if u.role == "vendor"] + [u for u in users if u.role != "vendor"]
+
+    response = None
+    for user in ordered:
+        # Re-read so each face sees the vendors registered by the previous one
+        session = session_manager.get_session(session.id) or session
+        response = _handle_scanned_user(session, user, background_tasks, db, BatchScanResponse)
+        if response.state == SessionState.APPROVED:
+            break
+
+    response.matches = matches
+    return response
+
+
+def _parse_scan_frame(frame: bytes):
+    """
+    Decode the header of one binary scan frame from the /scan-stream channel:
+        u8 session_id length | session_id (ASCII) | u32 request_id |
+        u16 face count | face count x EMBEDDING_DIM float32, little-endian
+    Returns (session_id, request_id, face count, payload).
+    """
+    if len(frame) < 1:
+        raise ValueError("Empty frame")
+    sid_len = frame[0]
+    header_len = 1 + sid_len + 6
+    if len(frame) < header_len:
+        raise ValueError("Truncated frame header")
+    session_id = frame[1:1 + sid_len].decode("ascii")
+    request_id, count = struct.unpack_from("<IH", frame, 1 + sid_len)
+    return session_id, request_id, count, memoryview(frame)[header_len:]
+
+
+def _frame_embeddings(count: int, payload) -> np.ndarray:
+    """Scan frame payload as a (count, EMBEDDING_DIM) float32 array"""
+    if count == 0 or len(payload) != count * EMBEDDING_DIM * 4:
+        raise ValueError(f"Payload must hold {count} x {EMBEDDING_DIM} float32 values")
+    return np.frombuffer(payload, dtype="<f4").reshape(count, EMBEDDING_DIM)
+
+
+_stream_tasks = set()  # Keeps background door flows started from the stream referenced
+
+
+@router.websocket("/scan-stream")
+async def scan_stream(websocket: WebSocket):
+    """
+    Persistent scan channel. The client sends binary frames (see
+    _parse_scan_frame) and gets one JSON text message back per frame, with
+    the same body as /scan (one face) or /scan-batch (several faces) plus
+    request_id. Errors come back as {"request_id", "status_code", "detail"}.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            frame = await websocket.receive_bytes()
+            request_id = None
+            try:
+                session_id, request_id, count, payload = _parse_scan_frame(frame)
+                # Header parsed: the 400 below carries the request_id the client waits on
+                embeddings = _frame_embeddings(count, payload)
+            except (ValueError, UnicodeDecodeError, struct.error) as e:
+                await websocket.send_json({"request_id": request_id, "status_code": 400, "detail": str(e)})
+                continue
+
+            background_tasks = BackgroundTasks()
+            db = database.SessionLocal()
+            try:
+                if len(embeddings) == 1:
+                    response = await run_blocking(_scan_sync, session_id, embeddings[0], background_tasks, db)
+                else:
+                    response = await run_blocking(_scan_batch_sync, session_id, embeddings, background_tasks, db)
+            except HTTPException as e:
+                await websocket.send_json({"request_id": request_id, "status_code": e.status_code, "detail": e.detail})
+                continue
+            except Exception as e:
+                # Answer like an HTTP 500 and keep the socket for the next frame
+                print(f"[SESSION {session_id}] Stream scan {request_id} failed: {e!r}")
+                await websocket.send_json({"request_id": request_id, "status_code": 500, "detail": "Internal server error"})
+                continue
+            finally:
+                db.close()
+
+            body = jsonable_encoder(response)
+            body["request_id"] = request_id
+            await websocket.send_json(body)
+
+            # No HTTP response to attach them to: run door flows and logging now
+            if background_tasks.tasks:
+                task = asyncio.create_task(background_tasks())
+                _stream_tasks.add(task)
+                task.add_done_callback(_stream_tasks.discard)
+    except WebSocketDisconnect:
+        pass
+
+
 async def unlock_door_flow(
     session_id: str,
     door_id: str = None,
@@ -359,7 +449,12 @@ async def unlock_door_flow(
             details={"all_vendor_ids": vendor_ids}
         )
     
-    result = await solenoid_client.unlock_and_auto_lock()
+    # Route to the gate's own door device; fall back to IOT_URL for
+    # single-door setups whose gate has no door_ip_address
+    gate_ip = await run_blocking(door_registry.resolve, door_id)
+    if door_id and not gate_ip:
+        print(f"[SESSION {session_id}] No device registered for door '{door_id}', using IOT_URL")
+    result = await lock_scheduler.unlock_and_auto_lock(gate_ip=gate_ip)
     
     # Log exit event after door locks
     if door_id:
@@ -373,34 +468,91 @@ async def unlock_door_flow(
         )
     
     print(f"[SESSION {session_id}] Door sequence complete: {result}")
-    session_manager.complete_session(session_id)
+    await run_blocking(session_manager.complete_session, session_id)
 
 
-@router.get("/{session_id}", response_model=SessionResponse)
-def get_session_status(session_id: str):
-    """Get current session status"""
-    session = session_manager.get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+STATE_MESSAGES = {
+    SessionState.WAITING_VENDORS: "Waiting for vendors to scan.",
+    SessionState.WAITING_PIC: "Vendors registered. Waiting for PIC.",
+    SessionState.APPROVED: "Access approved. Door unlocking.",
+    SessionState.COMPLETED: "Session completed.",
+    SessionState.EXPIRED: "Session expired.",
+    SessionState.CANCELLED: "Session cancelled.",
+}
 
-    state_messages = {
-        SessionState.WAITING_VENDORS: "Waiting for vendors to scan.",
-        SessionState.WAITING_PIC: "Vendors registered. Waiting for PIC.",
-        SessionState.APPROVED: "Access approved. Door unlocking.",
-        SessionState.COMPLETED: "Session completed.",
-        SessionState.EXPIRED: "Session expired.",
-        SessionState.CANCELLED: "Session cancelled.",
-    }
 
+def _status_response(session) -> SessionResponse:
     return SessionResponse(
         session_id=session.id,
         state=session.state,
-        message=state_messages.get(session.state, "Unknown state"),
+        message=STATE_MESSAGES.get(session.state, "Unknown state"),
         vendors=[v.name for v in session.vendors],
         pic={"name": session.pic.name, "user_id": session.pic.user_id} if session.pic else None,
     )
 
 
+@router.get("/gate/{gate_id}", response_model=SessionResponse)
+def get_gate_session(gate_id: str):
+    """Get the session currently in progress at a gate"""
+    session = session_manager.get_active_session_for_gate(gate_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="No active session for this gate")
+    return _status_response(session)
+
+
+@router.get("/{session_id}/events")
+async def stream_session_events(session_id: str, request: Request):
+    """
+    Server-Sent Events stream of a session's state.
+    Sends the current state first, then one `state` event per change, and
+    closes after the session finishes (completed, expired or cancelled).
+    """
+    session = await run_blocking(session_manager.get_session, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    async def events():
+        queue = session_events.subscribe(session_id)
+        current, last_sent = session, None
+        try:
+            while True:
+                if current is None:
+                    yield "event: gone\ndata: {}\n\n"
+                    return
+                payload = json.dumps(jsonable_encoder(_status_response(current)))
+                if payload != last_sent:
+                    yield f"event: state\ndata: {payload}\n\n"
+                    last_sent = payload
+                else:
+                    yield ": keep-alive\n\n"
+                if current.state in FINISHED_STATES or await request.is_disconnected():
+                    return
+
+                try:
+                    current = await asyncio.wait_for(queue.get(), timeout=SESSION_EVENTS_POLL)
+                except asyncio.TimeoutError:
+                    # Nothing published here; re-read in case another worker or
+                    # the reaper changed it
+                    current = await run_blocking(session_manager.get_session, session_id)
+        finally:
+            session_events.unsubscribe(session_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{session_id}", response_model=SessionResponse)
+def get_session_status(session_id: str):
+    """Get current session status"""
+    session = session_manager.get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return _status_response(session)
+
+
 @router.delete("/{session_id}")
 def cancel_session(session_id: str):
     """Cancel an active session"""
@@ -1,7 +1,120 @@
-from pydantic import BaseModel
-from typing import Optional, List
+import base64
+import binascii
+from pydantic import BaseModel, PrivateAttr, ValidationError, ValidationInfo, model_validator
+from typing import Literal, Optional, List
 from datetime import datetime
 
+import numpy as np
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
+
+from embedding_utils import EMBEDDING_DIM, decode_wire_embeddings
+
+# Embeddings can be sent as JSON float lists (validated one float at a time) or
+# as base64 of raw little-endian floats, which is decoded straight into NumPy.
+EmbeddingDtype = Literal["float32", "float16"]
+
+
+def _decode_b64(value: str, dtype: str, dim: Optional[int] = None) -> np.ndarray:
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"invalid base64 embedding: {e}")
+    return decode_wire_embeddings(raw, dtype, dim)
+
+
+def _raw_body(info: ValidationInfo) -> Optional[bytes]:
+    """Octet-stream body handed over by binary_body() through the validation context"""
+    return (info.context or {}).get("raw_body")
+
+
+class EmbeddingRequest(BaseModel):
+    """One face embedding: `embedding` (JSON list) or `embedding_b64`. Read it with vector()."""
+    embedding: Optional[List[float]] = None
+    embedding_b64: Optional[str] = None
+    embedding_dtype: EmbeddingDtype = "float32"
+    _vector: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    @model_validator(mode="after")
+    def _decode_embedding(self, info: ValidationInfo):
+        raw = _raw_body(info)
+        if raw is not None:
+            self._vector = decode_wire_embeddings(raw, self.embedding_dtype)[0]
+        elif self.embedding_b64 is not None:
+            self._vector = _decode_b64(self.embedding_b64, self.embedding_dtype)[0]
+        elif self.embedding is not None:
+            self._vector = np.asarray(self.embedding, dtype=np.float32)
+        else:
+            raise ValueError("embedding or embedding_b64 is required")
+        return self
+
+    def vector(self) -> np.ndarray:
+        return self._vector
+
+
+class EmbeddingBatchRequest(BaseModel):
+    """One embedding per face: `embeddings` (JSON lists) or `embeddings_b64`. Read them with vectors()."""
+    embeddings: Optional[List[List[float]]] = None
+    embeddings_b64: Optional[List[str]] = None
+    embedding_dtype: EmbeddingDtype = "float32"
+    _vectors: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    @model_validator(mode="after")
+    def _decode_embeddings(self, info: ValidationInfo):
+        raw = _raw_body(info)
+        if raw is not None:
+            # Octet-stream bodies carry the faces back to back
+            self._vectors = decode_wire_embeddings(raw, self.embedding_dtype, EMBEDDING_DIM)
+        elif self.embeddings_b64 is not None:
+            rows = [_decode_b64(value, self.embedding_dtype)[0] for value in self.embeddings_b64]
+            self._vectors = np.stack(rows) if rows else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        elif self.embeddings is not None:
+            self._vectors = np.asarray(self.embeddings, dtype=np.float32)
+        else:
+            raise ValueError("embeddings or embeddings_b64 is required")
+        return self
+
+    def vectors(self) -> np.ndarray:
+        return self._vectors
+
+
+def binary_body(model):
+    """
+    Dependency parsing `model` from a JSON body, or from application/octet-stream:
+    the body is the raw little-endian embedding(s) and the other fields come from
+    X-<Field-Name> headers (X-Session-Id, X-Embedding-Dtype, ...).
+    """
+    async def parse(request: Request):
+        body = await request.body()
+        content_type = request.headers.get("content-type", "").split(";")[0].strip()
+        try:
+            if content_type == "application/octet-stream":
+                fields = {}
+                for name in model.model_fields:
+                    header = "x-" + name.replace("_", "-")
+                    if header in request.headers:
+                        fields[name] = request.headers[header]
+                return model.model_validate(fields, context={"raw_body": body})
+            return model.model_validate_json(body)
+        except ValidationError as e:
+            errors = e.errors(include_url=False, include_context=False, include_input=False)
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in errors])
+    return parse
+
+
+def binary_body_openapi(model) -> dict:
+    """openapi_extra documenting both body encodings accepted by binary_body(model)"""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": model.model_json_schema()},
+                "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    }
+
+
 class AccessValidateRequest(BaseModel):
     vendor_id: int
     pic_id: int
@@ -10,6 +123,32 @@ class AccessValidateRequest(BaseModel):
     # Embeddings from IoT device (now required for verification)
     vendor_embedding: Optional[List[float]] = None
     pic_embedding: Optional[List[float]] = None
+    # Compact alternatives: base64 of raw little-endian floats
+    vendor_embedding_b64: Optional[str] = None
+    pic_embedding_b64: Optional[str] = None
+    embedding_dtype: EmbeddingDtype = "float32"
+    _vendor_vector: Optional[np.ndarray] = PrivateAttr(default=None)
+    _pic_vector: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    @model_validator(mode="after")
+    def _decode_embeddings(self):
+        for name in ("vendor", "pic"):
+            encoded = getattr(self, f"{name}_embedding_b64")
+            values = getattr(self, f"{name}_embedding")
+            if encoded:
+                vector = _decode_b64(encoded, self.embedding_dtype)[0]
+            elif values:
+                vector = np.asarray(values, dtype=np.float32)
+            else:
+                vector = None
+            setattr(self, f"_{name}_vector", vector)
+        return self
+
+    def vendor_vector(self) -> Optional[np.ndarray]:
+        return self._vendor_vector
+
+    def pic_vector(self) -> Optional[np.ndarray]:
+        return self._pic_vector
 
 class UserCreate(BaseModel):
     name: str
@@ -17,8 +156,11 @@ class UserCreate(BaseModel):
     face_image: Optional[str] = None # Base64 of the face (optional now)
     embedding: Optional[List[float]] = None # Pre-computed embedding from client
 
-class IdentifyRequest(BaseModel):
-    embedding: List[float]
+class IdentifyRequest(EmbeddingRequest):
+    pass
+
+class IdentifyBatchRequest(EmbeddingBatchRequest):
+    pass  # One embedding per detected face
 
 class AccessValidateResponse(BaseModel):
     approved: bool
@@ -0,0 +1,73 @@
+"""
+Session Events - In-process pub/sub of session state changes
+SessionManager publishes every transition here; the /api/session/{id}/events
+stream subscribes, so kiosks see approved/completed/expired as it happens
+instead of polling. Publishing is thread-safe (scan workers publish, the
+event loop consumes).
+"""
+import os
+import asyncio
+import threading
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from session_manager import AccessSession, session_manager
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+# Seconds between backend re-reads while a stream is idle. Covers changes this
+# process never sees: reaper expiry, or transitions made by another worker.
+SESSION_EVENTS_POLL = float(os.getenv("SESSION_EVENTS_POLL", "2.0"))
+SESSION_EVENTS_QUEUE_SIZE = 16
+
+
+class SessionEventBus:
+    """session_id -> subscriber queues, each bound to its event loop"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def subscribe(self, session_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SESSION_EVENTS_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(session_id, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, session_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = [s for s in self._subscribers.get(session_id, []) if s[1] is not queue]
+            if subscribers:
+                self._subscribers[session_id] = subscribers
+            else:
+                self._subscribers.pop(session_id, None)
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, session: AccessSession):
+        # A slow reader only needs the latest state: drop the oldest
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(session)
+
+    def publish(self, session: AccessSession):
+        """Hand a session snapshot to its subscribers (callable from any thread)"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(session.id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, session)
+            except RuntimeError:
+                pass  # Loop already closed
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._subscribers),
+                "subscribers": sum(len(s) for s in self._subscribers.values()),
+            }
+
+
+# Global session event bus, fed by the session manager
+session_events = SessionEventBus()
+session_manager.add_listener(session_events.publish)
@@ -1,13 +1,40 @@
 """
 Session Manager for Access Control
-Manages in-memory sessions for vendor→PIC sequential access flow.
+Manages sessions for vendor→PIC sequential access flow.
+Storage is pluggable: "memory" keeps sessions in lock-protected shards of
+this process; "sqlite" keeps them in a shared SQLite (WAL) file so several
+uvicorn workers see the same sessions. Every state transition runs as one
+atomic read-modify-write on the backend.
 """
+import os
+import json
 import uuid
+import heapq
+import sqlite3
 import asyncio
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from enum import Enum
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+
+from dotenv import load_dotenv
+
+from executor import run_blocking
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+SESSION_TIMEOUT_MINUTES = int(os.getenv("SESSION_TIMEOUT_MINUTES", "5"))
+# Session storage: memory (single worker) or sqlite (shared by all workers)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_DB_PATH = os.getenv(
+    "SESSION_DB_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "sessions.sqlite"),
+)
+SESSION_SHARDS = int(os.getenv("SESSION_SHARDS", "16"))
+# How long finished sessions stay queryable before they are dropped
+SESSION_RETAIN_SECONDS = int(os.getenv("SESSION_RETAIN_SECONDS", "60"))
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "5"))  # Seconds
 
 
 class SessionState(str, Enum):
@@ -19,6 +46,11 @@ class SessionState(str, Enum):
     CANCELLED = "cancelled"               # Session cancelled
 
 
+# States that still accept scans and therefore time out
+OPEN_STATES = (SessionState.WAITING_VENDORS, SessionState.WAITING_PIC)
+FINISHED_STATES = (SessionState.COMPLETED, SessionState.EXPIRED, SessionState.CANCELLED)
+
+
 @dataclass
 class ScannedPerson:
     user_id: int
@@ -36,6 +68,7 @@ class AccessSession:
     vendors: List[ScannedPerson] = field(default_factory=list)
     pic: Optional[ScannedPerson] = None
     gate_id: Optional[str] = None
+    finished_at: Optional[datetime] = None
 
     def is_expired(self) -> bool:
         return datetime.now() > self.expires_at
@@ -54,85 +87,473 @@ class AccessSession:
         }
 
 
+def _snapshot(session: AccessSession) -> AccessSession:
+    """Copy handed to callers so they never read a session mid-transition"""
+    return replace(session, vendors=list(session.vendors))
+
+
+def _finish(session: AccessSession, state: SessionState, now: Optional[datetime] = None):
+    session.state = state
+    session.finished_at = now or datetime.now()
+
+
+# A transition mutates the session in place and returns whether it was accepted
+Transition = Callable[[AccessSession], bool]
+
+
+# ----------------------------------------------------------------------
+# Backends
+# ----------------------------------------------------------------------
+
+class _Entry:
+    """A stored session and the lock that serializes its transitions"""
+    __slots__ = ("session", "lock")
+
+    def __init__(self, session: AccessSession):
+        self.session = session
+        self.lock = threading.Lock()
+
+
+class _Shard:
+    __slots__ = ("entries", "lock")
+
+    def __init__(self):
+        self.entries: Dict[str, _Entry] = {}
+        self.lock = threading.Lock()
+
+
+class MemorySessionBackend:
+    """Sessions in this process, sharded, with a lock per session"""
+
+    name = "memory"
+
+    def __init__(self, session_timeout: timedelta, retain: timedelta, shards: int = SESSION_SHARDS):
+        self.session_timeout = session_timeout
+        self.retain = retain
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        # (deadline, session_id): expiry of open sessions, removal of finished ones.
+        # Entries can be stale; they are checked against the session when popped.
+        self._deadlines: List[Tuple[datetime, str]] = []
+        self._deadlines_lock = threading.Lock()
+        self._active_by_gate: Dict[str, str] = {}
+        self._gate_lock = threading.Lock()
+
+    def _shard(self, session_id: str) -> _Shard:
+        return self._shards[hash(session_id) % len(self._shards)]
+
+    def _entry(self, session_id: str) -> Optional[_Entry]:
+        shard = self._shard(session_id)
+        with shard.lock:
+            return shard.entries.get(session_id)
+
+    def _push_deadline(self, deadline: datetime, session_id: str):
+        with self._deadlines_lock:
+            heapq.heappush(self._deadlines, (deadline, session_id))
+
+    def _on_finished(self, session: AccessSession):
+        """Bookkeeping once a session reached a final state (session lock held)"""
+        self._push_deadline(session.finished_at + self.retain, session.id)
+        if session.gate_id:
+            with self._gate_lock:
+                if self._active_by_gate.get(session.gate_id) == session.id:
+                    del self._active_by_gate[session.gate_id]
+
+    def insert(self, session: AccessSession) -> bool:
+        shard = self._shard(session.id)
+        with shard.lock:
+            if session.id in shard.entries:
+                return False
+            shard.entries[session.id] = _Entry(_snapshot(session))
+        self._push_deadline(session.expires_at, session.id)
+        if session.gate_id:
+            with self._gate_lock:
+                self._active_by_gate[session.gate_id] = session.id
+        return True
+
+    def get(self, session_id: str) -> Optional[AccessSession]:
+        entry = self._entry(session_id)
+        if not entry:
+            return None
+        with entry.lock:
+            return _snapshot(entry.session)
+
+    def update(self, session_id: str, apply: Transition) -> Optional[AccessSession]:
+        entry = self._entry(session_id)
+        if not entry:
+            return None
+        with entry.lock:
+            session = entry.session
+            finished_at = session.finished_at
+            accepted = apply(session)
+            if session.finished_at is not None and session.finished_at != finished_at:
+                self._on_finished(session)
+            return _snapshot(session) if accepted else None
+
+    def active_session_id(self, gate_id: str) -> Optional[str]:
+        with self._gate_lock:
+            return self._active_by_gate.get(gate_id)
+
+    def reap(self, now: datetime) -> int:
+        """
+        Only deadlines that are due are popped, so the cost doesn't grow with
+        the number of live sessions. Returns the number of sessions removed.
+        """
+        removed = 0
+        while True:
+            with self._deadlines_lock:
+                if not self._deadlines or self._deadlines[0][0] > now:
+                    break
+                _, session_id = heapq.heappop(self._deadlines)
+
+            shard = self._shard(session_id)
+            with shard.lock:
+                entry = shard.entries.get(session_id)
+                if entry is None:
+                    continue
+                with entry.lock:
+                    session = entry.session
+                    if session.state in FINISHED_STATES:
+                        if session.finished_at and session.finished_at + self.retain <= now:
+                            del shard.entries[session_id]
+                            removed += 1
+                    elif session.state == SessionState.APPROVED:
+                        # Normally finished by its door sequence; only give up
+                        # on one that has been stuck for another full timeout
+                        if now > session.expires_at + self.session_timeout:
+                            _finish(session, SessionState.COMPLETED, now)
+                            self._on_finished(session)
+                        else:
+                            self._push_deadline(session.expires_at + self.session_timeout, session_id)
+                    elif now > session.expires_at:
+                        _finish(session, SessionState.EXPIRED, now)
+                        self._on_finished(session)
+        return removed
+
+    def metrics(self) -> dict:
+        counts: Dict[str, int] = {}
+        for shard in self._shards:
+            with shard.lock:
+                entries = list(shard.entries.values())
+            for entry in entries:
+                state = entry.session.state.value
+                counts[state] = counts.get(state, 0) + 1
+        with self._deadlines_lock:
+            pending = len(self._deadlines)
+        return {"by_state": counts, "pending_deadlines": pending}
+
+
+class SqliteSessionBackend:
+    """
+    Sessions in a SQLite file in WAL mode, shared by every worker process.
+    Transitions run inside BEGIN IMMEDIATE, which takes the write lock before
+    reading, so two workers can't both approve the same session.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, session_timeout: timedelta, retain: timedelta, path: str = SESSION_DB_PATH):
+        self.session_timeout = session_timeout
+        self.retain = retain
+        self.path = path
+        self._local = threading.local()  # One connection per thread
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS access_sessions (
+                id TEXT PRIMARY KEY,
+                gate_id TEXT,
+                state TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                finished_at REAL,
+                vendors TEXT NOT NULL DEFAULT '[]',
+                pic TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS access_sessions_gate_id_created_at_index ON access_sessions (gate_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS access_sessions_state_expires_at_index ON access_sessions (state, expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS access_sessions_finished_at_index ON access_sessions (finished_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transactions are issued explicitly
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _person_to_dict(person: ScannedPerson) -> dict:
+        return {"user_id": person.user_id, "name": person.name, "role": person.role,
+                "scanned_at": person.scanned_at.isoformat()}
+
+    @staticmethod
+    def _person_from_dict(data: dict) -> ScannedPerson:
+        return ScannedPerson(user_id=data["user_id"], name=data["name"], role=data["role"],
+                             scanned_at=datetime.fromisoformat(data["scanned_at"]))
+
+    def _to_row(self, session: AccessSession) -> tuple:
+        return (
+            session.gate_id,
+            session.state.value,
+            session.created_at.timestamp(),
+            session.expires_at.timestamp(),
+            session.finished_at.timestamp() if session.finished_at else None,
+            json.dumps([self._person_to_dict(v) for v in session.vendors]),
+            json.dumps(self._person_to_dict(session.pic)) if session.pic else None,
+        )
+
+    def _from_row(self, row: tuple) -> AccessSession:
+        session_id, gate_id, state, created_at, expires_at, finished_at, vendors, pic = row
+        return AccessSession(
+            id=session_id,
+            state=SessionState(state),
+            created_at=datetime.fromtimestamp(created_at),
+            expires_at=datetime.fromtimestamp(expires_at),
+            vendors=[self._person_from_dict(v) for v in json.loads(vendors)],
+            pic=self._person_from_dict(json.loads(pic)) if pic else None,
+            gate_id=gate_id,
+            finished_at=datetime.fromtimestamp(finished_at) if finished_at is not None else None,
+        )
+
+    _COLUMNS = "id, gate_id, state, created_at, expires_at, finished_at, vendors, pic"
+
+    def insert(self, session: AccessSession) -> bool:
+        cursor = self._conn().execute(
+            f"INSERT OR IGNORE INTO access_sessions ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (session.id, *self._to_row(session)),
+        )
+        return cursor.rowcount == 1
+
+    def get(self, session_id: str) -> Optional[AccessSession]:
+        row = self._conn().execute(
+            f"SELECT {self._COLUMNS} FROM access_sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    def update(self, session_id: str, apply: Transition) -> Optional[AccessSession]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT {self._COLUMNS} FROM access_sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            session = self._from_row(row)
+            before = self._to_row(session)
+            accepted = apply(session)
+            after = self._to_row(session)
+            if after != before:
+                conn.execute(
+                    "UPDATE access_sessions SET gate_id = ?, state = ?, created_at = ?, expires_at = ?, "
+                    "finished_at = ?, vendors = ?, pic = ? WHERE id = ?",
+                    (*after, session_id),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return session if accepted else None
+
+    def active_session_id(self, gate_id: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT id FROM access_sessions WHERE gate_id = ? ORDER BY created_at DESC LIMIT 1",
+            (gate_id,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def reap(self, now: datetime) -> int:
+        """Same rules as the memory backend, as three indexed statements"""
+        ts = now.timestamp()
+        open_states = tuple(s.value for s in OPEN_STATES)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE access_sessions SET state = ?, finished_at = ? WHERE state IN (?, ?) AND expires_at < ?",
+                (SessionState.EXPIRED.value, ts, *open_states, ts),
+            )
+            conn.execute(
+                "UPDATE access_sessions SET state = ?, finished_at = ? WHERE state = ? AND expires_at < ?",
+                (SessionState.COMPLETED.value, ts, SessionState.APPROVED.value,
+                 ts - self.session_timeout.total_seconds()),
+            )
+            removed = conn.execute(
+                "DELETE FROM access_sessions WHERE finished_at IS NOT NULL AND finished_at <= ?",
+                (ts - self.retain.total_seconds(),),
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    def metrics(self) -> dict:
+        rows = self._conn().execute("SELECT state, COUNT(*) FROM access_sessions GROUP BY state").fetchall()
+        return {"by_state": dict(rows)}
+
+
+BACKENDS = {
+    "memory": MemorySessionBackend,
+    "sqlite": SqliteSessionBackend,
+}
+
+
+def create_backend(session_timeout: timedelta, retain: timedelta, name: str = SESSION_BACKEND):
+    """Instantiate a session backend by name, falling back to memory"""
+    backend_cls = BACKENDS.get(name)
+    if backend_cls is None:
+        print(f"[SESSION] Unknown SESSION_BACKEND '{name}', using memory")
+        backend_cls = MemorySessionBackend
+    return backend_cls(session_timeout, retain)
+
+
+# ----------------------------------------------------------------------
+# Manager
+# ----------------------------------------------------------------------
+
 class SessionManager:
-    """In-memory session store"""
+    """Access session lifecycle on top of a session backend"""
 
-    def __init__(self, session_timeout_minutes: int = 5):
-        self.sessions: Dict[str, AccessSession] = {}
+    def __init__(
+        self,
+        session_timeout_minutes: int = SESSION_TIMEOUT_MINUTES,
+        retain_seconds: int = SESSION_RETAIN_SECONDS,
+        backend=None,
+    ):
         self.session_timeout = timedelta(minutes=session_timeout_minutes)
+        self.retain = timedelta(seconds=retain_seconds)
+        self.backend = backend if backend is not None else create_backend(self.session_timeout, self.retain)
+        self._listeners: List[Callable[[AccessSession], None]] = []
+
+    def add_listener(self, listener: Callable[[AccessSession], None]):
+        """Call listener(session) after every transition that changed a session"""
+        self._listeners.append(listener)
+
+    def _notify(self, session: AccessSession):
+        for listener in self._listeners:
+            try:
+                listener(session)
+            except Exception as e:
+                print(f"[SESSION] Listener failed: {e}")
+
+    @staticmethod
+    def _expire_if_due(session: AccessSession):
+        if session.state in OPEN_STATES and session.is_expired():
+            _finish(session, SessionState.EXPIRED)
+
+    def _transition(self, session_id: str, fn: Optional[Transition] = None) -> Optional[AccessSession]:
+        """Atomically apply fn to the stored session (expiring it first if due)"""
+        changed = []
+
+        def apply(session: AccessSession) -> bool:
+            before = (session.state, len(session.vendors), session.pic)
+            self._expire_if_due(session)
+            accepted = fn(session) if fn else True
+            if (session.state, len(session.vendors), session.pic) != before:
+                changed.append(_snapshot(session))
+            return accepted
+
+        result = self.backend.update(session_id, apply)
+        if changed:
+            self._notify(changed[0])
+        return result
 
     def create_session(self, gate_id: Optional[str] = None) -> AccessSession:
         """Create a new access session"""
-        session_id = str(uuid.uuid4())[:8]
         now = datetime.now()
-        session = AccessSession(
-            id=session_id,
-            state=SessionState.WAITING_VENDORS,
-            created_at=now,
-            expires_at=now + self.session_timeout,
-            gate_id=gate_id,
-        )
-        self.sessions[session_id] = session
-        return session
+        while True:
+            session = AccessSession(
+                id=str(uuid.uuid4())[:8],
+                state=SessionState.WAITING_VENDORS,
+                created_at=now,
+                expires_at=now + self.session_timeout,
+                gate_id=gate_id,
+            )
+            if self.backend.insert(session):  # 8 hex chars can collide
+                self._notify(session)
+                return session
 
     def get_session(self, session_id: str) -> Optional[AccessSession]:
         """Get session by ID, checking expiration"""
-        session = self.sessions.get(session_id)
-        if session and session.is_expired():
-            session.state = SessionState.EXPIRED
+        session = self.backend.get(session_id)
+        if session and session.state in OPEN_STATES and session.is_expired():
+            session = self._transition(session_id)
         return session
 
-    def add_vendor(self, session_id: str, person: ScannedPerson) -> bool:
-        """Add a vendor to the session queue"""
-        session = self.get_session(session_id)
-        if not session:
-            return False
-        if session.state not in [SessionState.WAITING_VENDORS, SessionState.WAITING_PIC]:
-            return False
-
-        # Check if already scanned (by user_id)
-        for v in session.vendors:
-            if v.user_id == person.user_id:
-                return True  # Already in queue
-
-        session.vendors.append(person)
-        session.state = SessionState.WAITING_PIC  # Now waiting for PIC
-        return True
+    def get_active_session_for_gate(self, gate_id: str) -> Optional[AccessSession]:
+        """Most recent session at a gate that hasn't finished yet"""
+        session_id = self.backend.active_session_id(gate_id)
+        session = self.get_session(session_id) if session_id else None
+        if session is None or session.state in FINISHED_STATES:
+            return None
+        return session
 
-    def set_pic(self, session_id: str, person: ScannedPerson) -> bool:
-        """Set the PIC and approve the session"""
-        session = self.get_session(session_id)
-        if not session:
-            return False
-        if session.state != SessionState.WAITING_PIC:
-            return False
-        if len(session.vendors) == 0:
-            return False  # Need at least 1 vendor
-
-        session.pic = person
-        session.state = SessionState.APPROVED
-        return True
+    def add_vendor(self, session_id: str, person: ScannedPerson) -> Optional[AccessSession]:
+        """Add a vendor to the session queue. Returns the updated session, or None."""
+        def apply(session: AccessSession) -> bool:
+            if session.state not in OPEN_STATES:
+                return False
+            # Check if already scanned (by user_id)
+            if not any(v.user_id == person.user_id for v in session.vendors):
+                session.vendors.append(person)
+            session.state = SessionState.WAITING_PIC  # Now waiting for PIC
+            return True
+        return self._transition(session_id, apply)
+
+    def set_pic(self, session_id: str, person: ScannedPerson) -> Optional[AccessSession]:
+        """
+        Set the PIC and approve the session. Returns the approved session, or
+        None if it can't be approved (e.g. another scan approved it first).
+        """
+        def apply(session: AccessSession) -> bool:
+            if session.state != SessionState.WAITING_PIC:
+                return False
+            if len(session.vendors) == 0:
+                return False  # Need at least 1 vendor
+            session.pic = person
+            session.state = SessionState.APPROVED
+            return True
+        return self._transition(session_id, apply)
+
+    def _finish_with(self, session_id: str, state: SessionState):
+        def apply(session: AccessSession) -> bool:
+            if session.state in FINISHED_STATES:
+                return False
+            _finish(session, state)
+            return True
+        self._transition(session_id, apply)
 
     def complete_session(self, session_id: str):
         """Mark session as completed"""
-        session = self.get_session(session_id)
-        if session:
-            session.state = SessionState.COMPLETED
+        self._finish_with(session_id, SessionState.COMPLETED)
 
     def cancel_session(self, session_id: str):
         """Cancel a session"""
-        session = self.get_session(session_id)
-        if session:
-            session.state = SessionState.CANCELLED
-
-    def cleanup_expired(self):
-        """Remove expired sessions"""
-        expired = [
-            sid for sid, s in self.sessions.items()
-            if s.is_expired() or s.state in [SessionState.COMPLETED, SessionState.CANCELLED]
-        ]
-        for sid in expired:
-            del self.sessions[sid]
+        self._finish_with(session_id, SessionState.CANCELLED)
+
+    def cleanup_expired(self) -> int:
+        """
+        Expire timed-out sessions and drop finished ones once they are older
+        than SESSION_RETAIN_SECONDS. Returns the number of sessions removed.
+        """
+        return self.backend.reap(datetime.now())
+
+    async def reap_loop(self, interval: float = SESSION_REAP_INTERVAL):
+        """Background task: run cleanup_expired every SESSION_REAP_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_blocking(self.cleanup_expired)
+            except Exception as e:
+                print(f"[SESSION] Reaper failed: {e}")
+
+    def metrics(self) -> dict:
+        return {"backend": self.backend.name, **self.backend.metrics()}
 
 
 # Global session manager instance
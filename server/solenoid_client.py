@@ -1,8 +1,15 @@
 """
 Solenoid Client - HTTP client to control door lock IoT device
+Keeps one long-lived keep-alive connection pool per device, owned by the
+app lifespan, so a door actuation is a warm request instead of a fresh
+TCP handshake to the ESP8266.
 """
 import os
+import time
+import random
 import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
 import httpx
 from dotenv import load_dotenv
 
@@ -12,23 +19,135 @@ IOT_URL = os.getenv("IOT_URL", "http://192.168.1.100")
 IOT_SECRET = os.getenv("IOT_SECRET", "sentinel-iot-secret")
 DOOR_UNLOCK_DURATION = int(os.getenv("DOOR_UNLOCK_DURATION", "10"))
 
+# Default timeouts (seconds); override per device with
+# IOT_DEVICE_TIMEOUTS="http://192.168.1.102=3,http://192.168.1.103=8"
+IOT_CONNECT_TIMEOUT = float(os.getenv("IOT_CONNECT_TIMEOUT", "2.0"))
+IOT_TIMEOUT = float(os.getenv("IOT_TIMEOUT", "5.0"))
+IOT_DEVICE_TIMEOUTS = os.getenv("IOT_DEVICE_TIMEOUTS", "")
+# Retries for idempotent lock commands, with jittered exponential backoff
+IOT_LOCK_RETRIES = int(os.getenv("IOT_LOCK_RETRIES", "3"))
+IOT_RETRY_BACKOFF = float(os.getenv("IOT_RETRY_BACKOFF", "0.2"))
+
+
+def _parse_device_timeouts(raw: str) -> Dict[str, float]:
+    timeouts = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        url, seconds = item.rsplit("=", 1)
+        try:
+            timeouts[url.strip().rstrip("/")] = float(seconds)
+        except ValueError:
+            print(f"[SOLENOID] Ignoring invalid IOT_DEVICE_TIMEOUTS entry: {item}")
+    return timeouts
+
+
+class DeviceClientPool:
+    """One pooled keep-alive AsyncClient per door device, plus latency stats"""
+
+    def __init__(self, device_timeouts: Optional[Dict[str, float]] = None):
+        self.device_timeouts = device_timeouts if device_timeouts is not None else _parse_device_timeouts(IOT_DEVICE_TIMEOUTS)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._door_locks: Dict[str, asyncio.Lock] = {}
+        self._latency: Dict[Tuple[str, str], Deque[float]] = {}
+        self._failures: Dict[Tuple[str, str], int] = {}
+
+    def get(self, base_url: str) -> httpx.AsyncClient:
+        """Return the shared client for a device, creating it on first use"""
+        client = self._clients.get(base_url)
+        if client is None or client.is_closed:
+            read_timeout = self.device_timeouts.get(base_url, IOT_TIMEOUT)
+            client = httpx.AsyncClient(
+                base_url=base_url,
+                headers={"X-API-Secret": IOT_SECRET},
+                timeout=httpx.Timeout(read_timeout, connect=min(IOT_CONNECT_TIMEOUT, read_timeout)),
+                # The ESP8266 serves one request at a time; keep a single warm connection
+                limits=httpx.Limits(max_connections=1, max_keepalive_connections=1, keepalive_expiry=60),
+            )
+            self._clients[base_url] = client
+        return client
+
+    def door_lock(self, base_url: str) -> asyncio.Lock:
+        """Serializes commands to one door; different doors run concurrently"""
+        lock = self._door_locks.get(base_url)
+        if lock is None:
+            lock = self._door_locks[base_url] = asyncio.Lock()
+        return lock
+
+    def record(self, base_url: str, command: str, seconds: float, success: bool):
+        key = (base_url, command)
+        self._latency.setdefault(key, deque(maxlen=100)).append(seconds)
+        if not success:
+            self._failures[key] = self._failures.get(key, 0) + 1
+
+    def metrics(self) -> dict:
+        """Per device and command: count, failures and latency over the last 100 calls"""
+        result = {}
+        for (base_url, command), samples in self._latency.items():
+            ordered = sorted(samples)
+            result.setdefault(base_url, {})[command] = {
+                "samples": len(ordered),
+                "failures": self._failures.get((base_url, command), 0),
+                "last_ms": round(samples[-1] * 1000, 1),
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+            }
+        return result
+
+    async def aclose(self):
+        """Close every device connection (called on app shutdown)"""
+        clients, self._clients = list(self._clients.values()), {}
+        self._door_locks = {}
+        for client in clients:
+            await client.aclose()
+
+
+# Global device client pool
+device_pool = DeviceClientPool()
+
 
 async def _send_command(endpoint: str, gate_ip: str = None) -> dict:
     """Send command to solenoid IoT device"""
-    base_url = gate_ip or IOT_URL
-    url = f"{base_url}{endpoint}"
-    headers = {"X-API-Secret": IOT_SECRET}
-    
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.post(url, headers=headers)
-            return {"success": True, "status": response.status_code, "data": response.json()}
-    except httpx.ConnectError:
-        print(f"[SOLENOID] Connection failed to {base_url}")
-        return {"success": False, "error": "Connection failed"}
-    except Exception as e:
-        print(f"[SOLENOID] Error: {e}")
-        return {"success": False, "error": str(e)}
+    base_url = (gate_ip or IOT_URL).rstrip("/")
+    client = device_pool.get(base_url)
+    # Locking twice is harmless, so /lock is retried; /unlock is sent once
+    attempts = 1 + (IOT_LOCK_RETRIES if endpoint == "/lock" else 0)
+
+    async with device_pool.door_lock(base_url):
+        return await _send_with_retries(client, base_url, endpoint, attempts)
+
+
+async def _send_with_retries(client: httpx.AsyncClient, base_url: str, endpoint: str, attempts: int) -> dict:
+    result = None
+    for attempt in range(attempts):
+        started = time.perf_counter()
+        try:
+            response = await client.post(endpoint)
+            result = {"success": True, "status": response.status_code, "data": response.json()}
+            retryable = response.status_code >= 500
+        except httpx.ConnectError:
+            print(f"[SOLENOID] Connection failed to {base_url}")
+            result = {"success": False, "error": "Connection failed"}
+            retryable = True
+        except httpx.TransportError as e:
+            print(f"[SOLENOID] Transport error to {base_url}: {e!r}")
+            result = {"success": False, "error": str(e) or type(e).__name__}
+            retryable = True
+        except Exception as e:
+            print(f"[SOLENOID] Error: {e}")
+            result = {"success": False, "error": str(e)}
+            retryable = False
+        finally:
+            elapsed = time.perf_counter() - started
+
+        device_pool.record(base_url, endpoint, elapsed, result.get("success", False) and not retryable)
+        if not retryable or attempt == attempts - 1:
+            break
+        delay = IOT_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+        print(f"[SOLENOID] Retrying {endpoint} to {base_url} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    return result
 
 
 async def unlock_door(gate_ip: str = None) -> dict:
@@ -44,21 +163,3 @@ async def lock_door(gate_ip: str = None) -> dict:
     print(f"[SOLENOID] Sending LOCK to {target}")
     return await _send_command("/lock", gate_ip)
 
-
-async def unlock_and_auto_lock(duration_seconds: int = None) -> dict:
-    """Unlock door, wait, then lock"""
-    duration = duration_seconds or DOOR_UNLOCK_DURATION
-    
-    unlock_result = await unlock_door()
-    if not unlock_result.get("success"):
-        return unlock_result
-
-    print(f"[SOLENOID] Door unlocked, waiting {duration}s before locking...")
-    await asyncio.sleep(duration)
-    
-    lock_result = await lock_door()
-    return {
-        "unlock": unlock_result,
-        "lock": lock_result,
-        "duration": duration
-    }
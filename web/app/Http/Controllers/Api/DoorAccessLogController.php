@@ -7,6 +7,8 @@
 use App\Models\Gate;
 use Illuminate\Http\Request;
 use Illuminate\Http\JsonResponse;
+use Illuminate\Support\Carbon;
+use Illuminate\Support\Facades\DB;
 
 class DoorAccessLogController extends Controller
 {
@@ -57,6 +59,73 @@ public function logAccess(Request $request): JsonResponse
         ]);
     }
 
+    /**
+     * Log a batch of door access events spooled by the Python server.
+     * Events for unknown doors are skipped rather than failing the batch.
+     * 
+     * POST /api/doors/log-access/bulk
+     */
+    public function logAccessBulk(Request $request): JsonResponse
+    {
+        $validated = $request->validate([
+            'events' => 'required|array|max:500',
+            'events.*.door_id' => 'required|string',
+            'events.*.event_type' => 'required|in:entry,exit,denied',
+            'events.*.vendor_id' => 'nullable|integer',
+            'events.*.pic_id' => 'nullable|integer',
+            'events.*.task_id' => 'nullable|integer',
+            'events.*.session_id' => 'nullable|string',
+            'events.*.reason' => 'nullable|string',
+            'events.*.details' => 'nullable|array',
+            'events.*.occurred_at' => 'nullable|date',
+        ]);
+
+        $events = $validated['events'];
+
+        // Resolve every door in one query
+        $gateIds = Gate::whereIn('door_id', array_unique(array_column($events, 'door_id')))
+            ->pluck('id', 'door_id');
+
+        $rows = [];
+        $skipped = [];
+        $now = now();
+        foreach ($events as $index => $event) {
+            $gateId = $gateIds[$event['door_id']] ?? null;
+            if ($gateId === null) {
+                $skipped[] = $index;
+                continue;
+            }
+
+            // Keep the time the event happened, not the time it was delivered
+            $occurredAt = isset($event['occurred_at']) ? Carbon::parse($event['occurred_at']) : $now;
+            $rows[] = [
+                'gate_id' => $gateId,
+                'task_id' => $event['task_id'] ?? null,
+                'vendor_id' => $event['vendor_id'] ?? null,
+                'pic_id' => $event['pic_id'] ?? null,
+                'event_type' => $event['event_type'],
+                'reason' => $event['reason'] ?? null,
+                'details' => isset($event['details']) ? json_encode($event['details']) : null,
+                'session_id' => $event['session_id'] ?? null,
+                'client_ip' => $request->ip(),
+                'created_at' => $occurredAt,
+                'updated_at' => $now,
+            ];
+        }
+
+        DB::transaction(function () use ($rows) {
+            foreach (array_chunk($rows, 100) as $chunk) {
+                DoorAccessLog::insert($chunk);
+            }
+        });
+
+        return response()->json([
+            'success' => true,
+            'inserted' => count($rows),
+            'skipped' => $skipped,
+        ]);
+    }
+
     /**
      * Get access logs for a specific gate (for polling).
      * 
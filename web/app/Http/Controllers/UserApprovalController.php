@@ -19,7 +19,7 @@ class UserApprovalController extends Controller
     public function index(): View
     {
         $vendors = User::whereNotNull('face_image')
-            ->whereNull('face_embedding')
+            ->withoutFaceEmbedding()
             ->orderBy('created_at', 'desc')
             ->get();
         return view('vendors.pending', compact('vendors'));
@@ -43,7 +43,7 @@ public function approve(Request $request, User $user): RedirectResponse
         }
 
         // Already approved (has embedding)
-        if ($user->face_embedding) {
+        if ($user->isApproved()) {
             return redirect()->route('vendors.pending')
                 ->with('info', 'Vendor is already approved.');
         }
@@ -204,7 +204,7 @@ public function approve(User $user)
         }
 
         // Already approved (has embedding)
-        if ($user->face_embedding) {
+        if ($user->isApproved()) {
             return redirect()->route('users.show', $user)
                 ->with('info', 'User face is already approved.');
         }
@@ -255,6 +255,7 @@ public function reject(User $user)
 
         // Clear the embedding to "unapprove"
         $user->face_embedding = null;
+        $user->face_embedding_vector = null;
         $user->save();
 
         return redirect()->route('users.show', $user)
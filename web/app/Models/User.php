@@ -36,6 +36,7 @@ class User extends Authenticatable
         'password',
         'remember_token',
         'face_image', // Hide face image from serialization by default
+        'face_embedding_vector', // Binary, not JSON-serializable
     ];
 
     /**
@@ -63,10 +64,19 @@ public function isVendor(): bool
 
     /**
      * Check if the user's face has been approved (has embedding).
+     * The server stores only the packed vector; the JSON column is legacy.
      */
     public function isApproved(): bool
     {
-        return !empty($this->face_embedding);
+        return !empty($this->face_embedding_vector) || !empty($this->face_embedding);
+    }
+
+    /**
+     * Scope to users without any stored face embedding.
+     */
+    public function scopeWithoutFaceEmbedding($query)
+    {
+        return $query->whereNull('face_embedding_vector')->whereNull('face_embedding');
     }
 
     /**
@@ -0,0 +1,53 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\DB;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        Schema::table('users', function (Blueprint $table) {
+            // Packed little-endian float32 (or float16) embedding read by the FastAPI server
+            $table->binary('face_embedding_vector')->nullable()->after('face_embedding');
+        });
+
+        // Backfill from the JSON float list
+        DB::table('users')
+            ->whereNotNull('face_embedding')
+            ->orderBy('id')
+            ->chunkById(200, function ($users) {
+                foreach ($users as $user) {
+                    $values = json_decode($user->face_embedding, true);
+                    if (!is_array($values) || empty($values)) {
+                        continue;
+                    }
+
+                    // Store L2-normalized, matching the server's pack_embedding()
+                    $norm = sqrt(array_sum(array_map(fn ($v) => $v * $v, $values)));
+                    if ($norm > 0) {
+                        $values = array_map(fn ($v) => $v / $norm, $values);
+                    }
+
+                    DB::table('users')
+                        ->where('id', $user->id)
+                        ->update(['face_embedding_vector' => pack('g*', ...$values)]);
+                }
+            });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::table('users', function (Blueprint $table) {
+            $table->dropColumn('face_embedding_vector');
+        });
+    }
+};
@@ -0,0 +1,47 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     *
+     * Composite indexes for the FastAPI access validation queries:
+     * vendor → tasks, task → gates, and the PIC/status/time-window filter.
+     */
+    public function up(): void
+    {
+        Schema::table('task_vendor', function (Blueprint $table) {
+            $table->index(['vendor_id', 'task_id']);
+        });
+
+        Schema::table('gate_task', function (Blueprint $table) {
+            $table->index(['task_id', 'gate_id']);
+        });
+
+        Schema::table('tasks', function (Blueprint $table) {
+            $table->index(['pic_id', 'status', 'start_time', 'end_time']);
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::table('task_vendor', function (Blueprint $table) {
+            $table->dropIndex(['vendor_id', 'task_id']);
+        });
+
+        Schema::table('gate_task', function (Blueprint $table) {
+            $table->dropIndex(['task_id', 'gate_id']);
+        });
+
+        Schema::table('tasks', function (Blueprint $table) {
+            $table->dropIndex(['pic_id', 'status', 'start_time', 'end_time']);
+        });
+    }
+};
@@ -0,0 +1,42 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Support\Facades\DB;
+
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        // face_embedding_vector is the source of truth; the JSON float list is ~4x larger
+        DB::table('users')
+            ->whereNotNull('face_embedding_vector')
+            ->update(['face_embedding' => null]);
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        // Restore the JSON list from float32 vectors (float16 rows are left as they are)
+        DB::table('users')
+            ->whereNotNull('face_embedding_vector')
+            ->whereNull('face_embedding')
+            ->orderBy('id')
+            ->chunkById(200, function ($users) {
+                foreach ($users as $user) {
+                    $values = array_values(unpack('g*', $user->face_embedding_vector));
+                    if (count($values) !== 512) {
+                        continue;
+                    }
+
+                    DB::table('users')
+                        ->where('id', $user->id)
+                        ->update(['face_embedding' => json_encode($values)]);
+                }
+            });
+    }
+};
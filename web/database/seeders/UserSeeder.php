@@ -50,6 +50,7 @@ public function run(): void
                     'role' => $userData['role'],
                     'face_image' => $userData['face_image'],
                     'face_embedding' => $userData['face_embedding'],
+                    'face_embedding_vector' => null, // Repacked from JSON by the FastAPI server on startup
                     'email_verified_at' => $userData['email_verified_at'],
                     'remember_token' => $userData['remember_token'],
                 ]
@@ -73,10 +73,10 @@ function copyPassword() {
                 <div class="bg-white rounded-xl shadow-sm border border-light-200 p-6 text-center">
                     <!-- Face Image Preview -->
                     @if($user->face_image)
-                    <div class="w-32 h-32 rounded-full overflow-hidden mx-auto mb-4 border-4 {{ $user->face_embedding ? 'border-success/40' : 'border-warning/40' }}">
+                    <div class="w-32 h-32 rounded-full overflow-hidden mx-auto mb-4 border-4 {{ $user->isApproved() ? 'border-success/40' : 'border-warning/40' }}">
                         <img src="{{ $user->face_image }}" alt="{{ $user->name }}'s face" class="w-full h-full object-cover">
                     </div>
-                    @if($user->face_embedding)
+                    @if($user->isApproved())
                     <span class="inline-flex items-center gap-1 px-2 py-1 rounded-full text-xs font-medium bg-success/10 text-success mb-2">
                         <svg class="w-3.5 h-3.5" fill="currentColor" viewBox="0 0 20 20"><path fill-rule="evenodd" d="M16.707 5.293a1 1 0 010 1.414l-8 8a1 1 0 01-1.414 0l-4-4a1 1 0 011.414-1.414L8 12.586l7.293-7.293a1 1 0 011.414 0z" clip-rule="evenodd"></path></svg>
                         Approved
@@ -108,7 +108,7 @@ function copyPassword() {
                     @can('update', $user)
                     <div class="mt-6 pt-6 border-t border-light-200 space-y-3">
                         <!-- Approve/Reject Buttons -->
-                        @if($user->face_image && !$user->face_embedding)
+                        @if($user->face_image && !$user->isApproved())
                         <form action="{{ route('users.approve', $user) }}" method="POST">
                             @csrf
                             <button type="submit" class="inline-flex items-center justify-center w-full px-4 py-2 bg-success text-white text-sm font-medium rounded-lg hover:bg-success/90 transition-colors gap-2">
@@ -116,7 +116,7 @@ function copyPassword() {
                                 Approve Face
                             </button>
                         </form>
-                        @elseif($user->face_embedding)
+                        @elseif($user->isApproved())
                         <form action="{{ route('users.reject', $user) }}" method="POST">
                             @csrf
                             <button type="submit" class="inline-flex items-center justify-center w-full px-4 py-2 bg-error/10 text-error text-sm font-medium rounded-lg hover:bg-error/20 transition-colors gap-2">
@@ -21,6 +21,7 @@
 
 // Door Access Log Endpoints (for Python server integration)
 Route::post('/doors/log-access', [DoorAccessLogController::class, 'logAccess']);
+Route::post('/doors/log-access/bulk', [DoorAccessLogController::class, 'logAccessBulk']);
 // Heartbeat is now handled by Python server directly - Route::post('/doors/heartbeat', ...) removed
 Route::get('/doors/{door_id}/info', [DoorAccessLogController::class, 'gateInfo']);
 